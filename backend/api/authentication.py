@@ -0,0 +1,117 @@
+from collections import OrderedDict
+from copy import deepcopy
+from hashlib import sha256
+from threading import Lock
+from time import monotonic
+
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.exceptions import AuthenticationFailed
+
+TOKEN_CACHE_TIMEOUT = 60 * 5
+LOCAL_TOKEN_TTL = 5
+LOCAL_TOKEN_CACHE_SIZE = 1024
+INACTIVE_USER_ERROR = 'Пользователь неактивен или удалён.'
+INVALID_TOKEN_ERROR = 'Недопустимый токен.'
+
+
+class LocalCache:
+    """LRU-кэш процесса с ограниченным временем жизни записей."""
+
+    def __init__(self, size, ttl):
+        self.size = size
+        self.ttl = ttl
+        self.items = OrderedDict()
+        self.lock = Lock()
+
+    def get(self, key):
+        with self.lock:
+            item = self.items.get(key)
+            if item is None:
+                return None
+            expires, value = item
+            if expires < monotonic():
+                del self.items[key]
+                return None
+            self.items.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.items[key] = monotonic() + self.ttl, value
+            self.items.move_to_end(key)
+            while len(self.items) > self.size:
+                self.items.popitem(last=False)
+
+    def delete(self, key):
+        with self.lock:
+            self.items.pop(key, None)
+
+
+local_tokens = LocalCache(LOCAL_TOKEN_CACHE_SIZE, LOCAL_TOKEN_TTL)
+
+
+def token_cache_key(key):
+    return f'auth:token:{sha256(key.encode()).hexdigest()}'
+
+
+def invalidate_tokens(*keys):
+    """Удаляет токены из общего кэша и из кэша текущего процесса.
+
+    Другие процессы перестают принимать токен не позже чем через
+    LOCAL_TOKEN_TTL секунд.
+    """
+    cache_keys = [token_cache_key(key) for key in keys]
+    cache.delete_many(cache_keys)
+    for cache_key in cache_keys:
+        local_tokens.delete(cache_key)
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """TokenAuthentication, который не ходит в базу на каждый запрос.
+
+    Пара (пользователь, токен) хранится в LRU-кэше процесса. В общем
+    кэше Django лежит только id пользователя под хэшем токена:
+    ни хэш пароля, ни сам токен не попадают в хранилище, общее для
+    процессов. При попадании в общий кэш пользователь читается
+    по первичному ключу без поиска токена. Источник ответа (local,
+    shared или miss) попадает в статистику запроса
+    RequestStatsMiddleware.
+    """
+
+    def authenticate(self, request):
+        self.source = None
+        result = super().authenticate(request)
+        stats = getattr(request, 'stats', None)
+        if stats is not None and self.source is not None:
+            stats.auth_cache = self.source
+        return result
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        self.source = 'local'
+        credentials = local_tokens.get(cache_key)
+        if credentials is None:
+            self.source = 'shared'
+            credentials = self.load_credentials(key, cache.get(cache_key))
+            if credentials is None:
+                self.source = 'miss'
+                credentials = super().authenticate_credentials(key)
+                cache.set(
+                    cache_key, credentials[0].pk, TOKEN_CACHE_TIMEOUT
+                )
+            local_tokens.set(cache_key, credentials)
+        user, token = deepcopy(credentials)
+        if not user.is_active:
+            raise AuthenticationFailed(INACTIVE_USER_ERROR)
+        return user, token
+
+    def load_credentials(self, key, user_id):
+        """Пара (пользователь, токен) по id из общего кэша."""
+        if user_id is None:
+            return None
+        user = get_user_model().objects.filter(pk=user_id).first()
+        if user is None:
+            raise AuthenticationFailed(INVALID_TOKEN_ERROR)
+        return user, self.get_model()(key=key, user=user)
@@ -0,0 +1,137 @@
+from copy import deepcopy
+from functools import partial
+from hashlib import sha256
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import transaction
+
+from core.routers import primary_reads
+from core.versions import bump_versions, get_versions
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscription
+
+RECIPES_CACHE_TIMEOUT = 60 * 10
+LIST_VERSION_KEY = 'recipes:list:version'
+SHARED_VERSION_KEY = 'recipes:shared:version'
+USER_FILTERS = ('is_favorited', 'is_in_shopping_cart')
+
+
+def recipe_version_key(pk):
+    return f'recipes:{pk}:version'
+
+
+def bump_recipe_versions(*recipe_ids, shared=False):
+    """Инвалидирует кэш списков и, при необходимости, рецептов.
+
+    recipe_ids сбрасывают кэш отдельных рецептов, shared — всех рецептов
+    сразу (используется при изменении тегов, ингредиентов и авторов).
+    """
+    keys = [LIST_VERSION_KEY]
+    keys.extend(recipe_version_key(pk) for pk in recipe_ids)
+    if shared:
+        keys.append(SHARED_VERSION_KEY)
+    transaction.on_commit(partial(bump_versions, *keys))
+
+
+def list_cache_key(request):
+    """Ключ кэша для списка рецептов или None, если список персональный."""
+    params = request.query_params
+    if any(params.get(name) not in (None, '', '0') for name in USER_FILTERS):
+        return None
+    query = urlencode(sorted(
+        (name, value) for name in params for value in params.getlist(name)
+    ))
+    version = get_versions(LIST_VERSION_KEY)[LIST_VERSION_KEY]
+    # Ключи memcached не длиннее 250 символов, строка запроса — любой.
+    return f'recipes:list:{version}:{sha256(query.encode()).hexdigest()}'
+
+
+def detail_cache_key(pk):
+    """Ключ кэша для рецепта или None, если pk не число."""
+    if not str(pk).isdigit():
+        return None
+    keys = (SHARED_VERSION_KEY, recipe_version_key(int(pk)))
+    versions = get_versions(*keys)
+    return 'recipes:detail:{}:{}:{}'.format(
+        int(pk), *(versions[key] for key in keys)
+    )
+
+
+def get_recipes(data):
+    if 'results' in data:
+        return data['results']
+    return [data]
+
+
+def strip_user_flags(data):
+    """Возвращает копию ответа с флагами анонимного пользователя."""
+    data = deepcopy(data)
+    for recipe in get_recipes(data):
+        recipe['is_favorited'] = False
+        recipe['is_in_shopping_cart'] = False
+        recipe['author']['is_subscribed'] = False
+    return data
+
+
+def merge_user_flags(recipes, user):
+    """Проставляет в рецептах флаги текущего пользователя."""
+    if not user.is_authenticated or not recipes:
+        return recipes
+    recipe_ids = [recipe['id'] for recipe in recipes]
+    author_ids = {recipe['author']['id'] for recipe in recipes}
+    favorited = set(Favorite.objects.filter(
+        user=user, recipe__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+    in_shopping_cart = set(ShoppingCart.objects.filter(
+        user=user, recipe__in=recipe_ids
+    ).values_list('recipe_id', flat=True))
+    subscribed = set(Subscription.objects.filter(
+        user=user, author__in=author_ids
+    ).values_list('author_id', flat=True))
+    for recipe in recipes:
+        recipe['is_favorited'] = recipe['id'] in favorited
+        recipe['is_in_shopping_cart'] = recipe['id'] in in_shopping_cart
+        recipe['author']['is_subscribed'] = (
+            recipe['author']['id'] in subscribed
+        )
+    return recipes
+
+
+def merge_counters(recipes):
+    """Проставляет в рецептах текущее число добавлений в избранное.
+
+    Счётчик меняется при каждом клике «в избранное», поэтому
+    он читается одним запросом по первичному ключу, а не сбрасывает
+    кэш всех страниц списка.
+    """
+    if not recipes:
+        return recipes
+    counters = dict(Recipe.objects.filter(
+        pk__in=[recipe['id'] for recipe in recipes]
+    ).values_list('id', 'favorites_count'))
+    for recipe in recipes:
+        recipe['favorites_count'] = counters.get(
+            recipe['id'], recipe['favorites_count']
+        )
+    return recipes
+
+
+def cached_recipes(key, user, build):
+    """Отдаёт ответ из кэша, дополняя его счётчиками и флагами пользователя.
+
+    В кэше хранится ответ без персональных данных, общий для всех;
+    build вызывается при промахе и возвращает Response для user.
+    Ответ для кэша строится по основной базе, а счётчики и флаги
+    при попадании можно читать и с реплики: они свежие на каждый запрос.
+    """
+    data = cache.get(key)
+    if data is None:
+        with primary_reads():
+            data = build().data
+        cache.set(key, strip_user_flags(data), RECIPES_CACHE_TIMEOUT)
+        return data
+    recipes = get_recipes(data)
+    merge_counters(recipes)
+    merge_user_flags(recipes, user)
+    return data
@@ -1,6 +1,9 @@
+from django.core.files.storage import default_storage
 from drf_extra_fields.fields import Base64ImageField
 from rest_framework import serializers
 
+from recipes.images import rendition_names
+
 
 class Base64ImageField(Base64ImageField):
 
@@ -8,3 +11,24 @@ class Base64ImageField(Base64ImageField):
         if not base64_data:
             raise serializers.ValidationError("This field could not be empty")
         return super().to_internal_value(base64_data)
+
+
+class ImageRenditionsField(serializers.ReadOnlyField):
+    """URL вариантов изображения.
+
+    Варианты строит фоновая задача, и пока варианта нет в хранилище,
+    вместо него отдаётся исходное изображение.
+    """
+
+    def to_representation(self, image):
+        if not image:
+            return None
+        request = self.context.get('request')
+        urls = {}
+        for key, name in rendition_names(image.name).items():
+            if default_storage.exists(name):
+                url = default_storage.url(name)
+            else:
+                url = image.url
+            urls[key] = request.build_absolute_uri(url) if request else url
+        return urls
@@ -1,6 +1,12 @@
+from django.db.models import Exists, OuterRef
 from django_filters.rest_framework import FilterSet, filters
 
-from recipes.models import Ingredient, Recipe
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart
+from recipes.search import get_tag_ids
+
+
+def tag_choices():
+    return [(slug, slug) for slug in get_tag_ids()]
 
 
 class IngredientFilter(FilterSet):
@@ -13,8 +19,8 @@ class IngredientFilter(FilterSet):
 
 class RecipeFilter(FilterSet):
     author = filters.CharFilter()
-    tags = filters.AllValuesMultipleFilter(
-        field_name='tags__slug', lookup_expr='contains'
+    tags = filters.MultipleChoiceFilter(
+        choices=tag_choices, method='filter_tags'
     )
     is_favorited = filters.NumberFilter(
         method='filter_is_favorited'
@@ -22,21 +28,36 @@ class RecipeFilter(FilterSet):
     is_in_shopping_cart = filters.NumberFilter(
         method='filter_is_in_shopping_cart'
     )
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
         fields = (
-            'tags', 'author', 'is_favorited', 'is_in_shopping_cart'
+            'tags', 'author', 'is_favorited', 'is_in_shopping_cart', 'search'
         )
 
-    def filter_is_favorited(self, queryset, name, value):
+    def filter_tags(self, queryset, name, value):
+        tag_ids = get_tag_ids()
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe=OuterRef('pk'),
+            tag_id__in=[tag_ids[slug] for slug in value if slug in tag_ids],
+        )))
+
+    def filter_user_relation(self, queryset, model, value):
         user = self.request.user
         if value and user.is_authenticated:
-            return queryset.filter(favorite_recipe__user=user)
+            return queryset.filter(Exists(model.objects.filter(
+                recipe=OuterRef('pk'), user=user
+            )))
         return queryset
 
+    def filter_is_favorited(self, queryset, name, value):
+        return self.filter_user_relation(queryset, Favorite, value)
+
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
-        if value and user.is_authenticated:
-            return queryset.filter(shopping_cart__user=user)
+        return self.filter_user_relation(queryset, ShoppingCart, value)
+
+    def filter_search(self, queryset, name, value):
+        if value.strip():
+            return queryset.search(value)
         return queryset
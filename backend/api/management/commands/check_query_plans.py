@@ -0,0 +1,44 @@
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+
+from api.query_plans import explain_queries, explain_supported
+from users.models import User
+
+
+class Command(BaseCommand):
+    help = (
+        'Выполняет EXPLAIN для основных запросов API и сообщает '
+        'о последовательном чтении больших таблиц.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verbose-plans', action='store_true',
+            help='Выводить планы запросов целиком.',
+        )
+
+    def handle(self, *args, **options):
+        if not explain_supported():
+            raise CommandError(
+                f'EXPLAIN не поддерживается для {connection.vendor}.'
+            )
+        user = User.objects.filter(subscriber__isnull=False).first()
+        if user is None:
+            raise CommandError(
+                'Нет данных для проверки, сначала выполните generate_dataset.'
+            )
+        failures = []
+        for name, (plan, scans) in explain_queries(user).items():
+            if options['verbose_plans']:
+                self.stdout.write(f'{name}:\n{plan}\n')
+            if scans:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR(
+                    f'{name}: последовательное чтение {", ".join(scans)}'
+                ))
+            else:
+                self.stdout.write(f'{name}: OK')
+        if failures:
+            raise CommandError(
+                f'Запросы без подходящих индексов: {", ".join(failures)}'
+            )
@@ -0,0 +1,73 @@
+from functools import partial
+from time import perf_counter
+
+from rest_framework.permissions import SAFE_METHODS
+
+from core.routers import (
+    enable_replica_reads, replica_reads_allowed, reset_replica_reads
+)
+
+
+class QueryBudgetMixin:
+    """Передаёт RequestStatsMiddleware имя действия и его бюджет запросов.
+
+    query_budgets задаёт максимум запросов к БД для действий
+    представления, например {'list': 8}; ключ вида 'me.delete' задаёт
+    бюджет для одного HTTP-метода действия. Для представлений без action
+    ключом служит HTTP-метод в нижнем регистре.
+    """
+
+    query_budgets = {}
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        stats = getattr(request, 'stats', None)
+        if stats is not None:
+            self.handler_started = perf_counter(), stats.db_time
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        response = super().finalize_response(
+            request, response, *args, **kwargs
+        )
+        stats = getattr(request, 'stats', None)
+        if stats is None:
+            return response
+        action = getattr(self, 'action', None) or request.method.lower()
+        stats.view = f'{type(self).__name__}.{action}'
+        stats.budget = self.query_budgets.get(
+            f'{action}.{request.method.lower()}',
+            self.query_budgets.get(action)
+        )
+        if hasattr(self, 'handler_started'):
+            started, db_time = self.handler_started
+            stats.serialize_time = (
+                perf_counter() - started - (stats.db_time - db_time)
+            )
+        if not getattr(response, 'is_rendered', True):
+            response.add_post_render_callback(
+                partial(stats.set_render_time, perf_counter())
+            )
+        return response
+
+
+class ReplicaReadMixin:
+    """Читает данные безопасных запросов с реплики базы.
+
+    Пользователь, недавно что-то записавший, читает с основной базы,
+    чтобы сразу видеть свои изменения.
+    """
+
+    replica_token = None
+
+    def initial(self, request, *args, **kwargs):
+        super().initial(request, *args, **kwargs)
+        if request.method in SAFE_METHODS and replica_reads_allowed(
+            request.user
+        ):
+            self.replica_token = enable_replica_reads()
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        if self.replica_token is not None:
+            reset_replica_reads(self.replica_token)
+            self.replica_token = None
+        return super().finalize_response(request, response, *args, **kwargs)
@@ -1,6 +1,127 @@
+from base64 import urlsafe_b64decode, urlsafe_b64encode
+from collections import OrderedDict
+from datetime import datetime
+from functools import partial
+
+from django.db.models import Q
+from rest_framework.exceptions import NotFound, ValidationError
 from rest_framework.pagination import PageNumberPagination
+from rest_framework.response import Response
+from rest_framework.utils.urls import remove_query_param, replace_query_param
+
+INVALID_CURSOR_ERROR = 'Неверный курсор.'
+INVALID_PAGE_ERROR = 'Неверный номер страницы.'
+RANKED_CURSOR_ERROR = 'Курсор нельзя использовать вместе с поиском.'
 
 
 class FoodgramPagination(PageNumberPagination):
     page_size = 6
     page_size_query_param = 'limit'
+
+
+class RecipePagination(FoodgramPagination):
+    """Постраничная выдача рецептов с опциональным режимом курсора.
+
+    С параметром cursor страница выбирается по ключу (pub_date, id)
+    последнего показанного рецепта, без OFFSET и COUNT(*).
+    Выдача поиска упорядочена по рангу, а не по этому ключу,
+    поэтому курсор вместе с поиском отклоняется.
+    """
+
+    cursor_query_param = 'cursor'
+    without_count = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        if self.cursor_query_param not in request.query_params:
+            return super().paginate_queryset(queryset, request, view)
+        if 'rank' in queryset.query.annotations:
+            raise ValidationError(
+                {self.cursor_query_param: [RANKED_CURSOR_ERROR]}
+            )
+        return self.paginate_cursor(
+            request, partial(self.keyset_page, queryset)
+        )
+
+    def paginate_cursor(self, request, fetch):
+        """Отдаёт страницу в режиме курсора.
+
+        fetch(position, limit) возвращает до limit рецептов, идущих
+        после позиции курсора в порядке убывания (pub_date, id).
+        """
+        self.without_count = True
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(
+            request.query_params.get(self.cursor_query_param)
+        )
+        page = fetch(position, page_size + 1)
+        self.has_next = len(page) > page_size
+        page = page[:page_size]
+        self.last = page[-1] if page else None
+        self.next_link = self.get_next_cursor_link()
+        return page
+
+    def paginate_ranked(self, request, fetch):
+        """Отдаёт страницу ранжированной выдачи без COUNT(*).
+
+        fetch(offset, limit) возвращает до limit рецептов, начиная
+        с позиции offset в порядке ранжирования.
+        """
+        self.without_count = True
+        page_size = self.get_page_size(request)
+        try:
+            number = int(request.query_params.get(self.page_query_param, 1))
+        except ValueError:
+            raise NotFound(INVALID_PAGE_ERROR)
+        if number < 1:
+            raise NotFound(INVALID_PAGE_ERROR)
+        page = fetch((number - 1) * page_size, page_size + 1)
+        self.next_link = None
+        if len(page) > page_size:
+            self.next_link = replace_query_param(
+                request.build_absolute_uri(), self.page_query_param,
+                number + 1
+            )
+        return page[:page_size]
+
+    def keyset_page(self, queryset, position, limit):
+        queryset = queryset.order_by('-pub_date', '-id')
+        if position is not None:
+            pub_date, pk = position
+            queryset = queryset.filter(
+                Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk)
+            )
+        return list(queryset[:limit])
+
+    def get_paginated_response(self, data):
+        if not self.without_count:
+            return super().get_paginated_response(data)
+        return Response(OrderedDict([
+            ('next', self.next_link),
+            ('results', data),
+        ]))
+
+    def get_next_cursor_link(self):
+        if not self.has_next:
+            return None
+        url = remove_query_param(
+            self.request.build_absolute_uri(), self.page_query_param
+        )
+        return replace_query_param(
+            url, self.cursor_query_param, self.encode_cursor(self.last)
+        )
+
+    def encode_cursor(self, recipe):
+        position = f'{recipe.pub_date.isoformat()}|{recipe.id}'
+        return urlsafe_b64encode(position.encode()).decode()
+
+    def decode_cursor(self, encoded):
+        if not encoded:
+            return None
+        try:
+            pub_date, pk = urlsafe_b64decode(
+                encoded.encode()
+            ).decode().split('|')
+            return datetime.fromisoformat(pub_date), int(pk)
+        except (TypeError, ValueError):
+            raise NotFound(INVALID_CURSOR_ERROR)
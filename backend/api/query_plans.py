@@ -0,0 +1,94 @@
+import re
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+from django.db import connection, transaction
+from django.db.models import Q
+
+from .filters import RecipeFilter
+from recipes.models import FeedEntry, Recipe, RecipeIngredient, Tag
+from users.models import User
+
+LARGE_TABLES = {
+    'recipes_recipe',
+    'recipes_recipeingredient',
+    'recipes_recipe_tags',
+    'recipes_favorite',
+    'recipes_feedentry',
+    'recipes_shoppingcart',
+    'recipes_similarrecipe',
+    'users_subscription',
+    'users_user',
+}
+SEQUENTIAL_SCANS = {
+    'postgresql': re.compile(r'Seq Scan on (\w+)'),
+    'sqlite': re.compile(r'\bSCAN (\w+)\b(?! USING)'),
+}
+
+
+def recipe_feed(user, **params):
+    return RecipeFilter(
+        params, queryset=Recipe.objects.all(),
+        request=SimpleNamespace(user=user),
+    ).qs.order_by('-pub_date', '-id')[:6]
+
+
+def get_queries(user):
+    """Основные запросы API, планы которых проверяются."""
+    tag = Tag.objects.order_by('id').first()
+    recipe = Recipe.objects.order_by('id').first()
+    return {
+        'recipe feed': recipe_feed(user),
+        'recipe feed cursor': Recipe.objects.filter(
+            Q(pub_date__lt=datetime.now(timezone.utc))
+            | Q(pub_date=datetime.now(timezone.utc), id__lt=1)
+        ).order_by('-pub_date', '-id')[:6],
+        'author feed': recipe_feed(user, author=str(user.id)),
+        'tag filter': recipe_feed(user, tags=[tag.slug] if tag else []),
+        'favorites': recipe_feed(user, is_favorited='1'),
+        'shopping cart': recipe_feed(user, is_in_shopping_cart='1'),
+        'user flags': Recipe.objects.with_user_flags(user).order_by(
+            '-pub_date', '-id'
+        )[:6],
+        'subscriptions': User.objects.filter(
+            subscription__user=user
+        ).with_is_subscribed(user)[:6],
+        'subscription recipes': Recipe.objects.filter(
+            author__in=User.objects.filter(subscription__user=user)
+        ).latest_per_author(3),
+        'feed': FeedEntry.objects.filter(user=user).order_by(
+            '-pub_date', '-recipe_id'
+        ).values_list('pub_date', 'recipe_id')[:7],
+        'similar recipes': Recipe.objects.filter(
+            similar_to__recipe=recipe
+        ).order_by('-similar_to__score'),
+        'shopping list': RecipeIngredient.objects.filter(
+            recipe__shopping_cart__user=user
+        ).values_list('ingredient__name', 'amount'),
+    }
+
+
+def explain_supported():
+    return connection.vendor in SEQUENTIAL_SCANS
+
+
+def explain_queries(user):
+    """Выполняет EXPLAIN основных запросов API.
+
+    Возвращает словарь имя запроса -> (план, большие таблицы, которые
+    план читает последовательно). На PostgreSQL последовательное чтение
+    отключается, чтобы и на маленьких таблицах планировщик выбрал
+    индекс, если он есть.
+    """
+    pattern = SEQUENTIAL_SCANS[connection.vendor]
+    results = {}
+    with transaction.atomic():
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute('SET LOCAL enable_seqscan = off')
+        for name, queryset in get_queries(user).items():
+            plan = queryset.explain()
+            results[name] = (
+                plan, sorted(set(pattern.findall(plan)) & LARGE_TABLES)
+            )
+    return results
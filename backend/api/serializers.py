@@ -1,14 +1,20 @@
 from django.contrib.auth.validators import UnicodeUsernameValidator
+from django.db import transaction
+from django.db.models import Prefetch, prefetch_related_objects
 from djoser.serializers import UserCreateSerializer, UserSerializer
 from rest_framework import exceptions, serializers
 from rest_framework.validators import UniqueValidator
 
-from .fields import Base64ImageField
+from .fields import Base64ImageField, ImageRenditionsField
+from .filters import tag_choices
 from .validators import validate_username
 from core.enums import Length
+from core.utils import get_recipes_limit
 from recipes.models import (
     Favorite, Ingredient, Recipe, RecipeIngredient, Tag, ShoppingCart
 )
+from recipes.search import get_tag_ids
+from recipes.tasks import refresh_recipe_features
 from users.models import User, Subscription
 
 
@@ -20,6 +26,9 @@ INGREDIENTS_NOT_FOUND_ERROR = 'Количество ингредиентов н
 RECIPE_NOT_FOUND_VALIDATION_ERROR = 'Рецепт не найден в корзине.'
 RECIPE_VALIDATION_ERROR_FAVORITES = 'Рецепт уже добавлен в избранное.'
 NOT_FOUND_FIELDS_ERROR = 'Не хватает поля тэгов или ингредиентов.'
+NOT_FOUND_IDS_ERROR = 'Объекты с id {} не найдены.'
+BULK_RECIPES_LIMIT = 100
+PANTRY_INGREDIENTS_LIMIT = 50
 
 
 class UserGetSerializer(UserSerializer):
@@ -35,7 +44,9 @@ class UserGetSerializer(UserSerializer):
         read_only_fields = ('id', 'is_subscribed')
 
     def get_is_subscribed(self, obj):
-        user = self.request.user
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
+        user = self.context['request'].user
         return user.is_authenticated and obj.subscription.filter(
             user=user
         ).exists()
@@ -82,15 +93,16 @@ class TagSerializer(serializers.ModelSerializer):
 
 class RecipeMiniSerializer(serializers.ModelSerializer):
     image = Base64ImageField()
+    renditions = ImageRenditionsField(source='image')
 
     class Meta:
         model = Recipe
-        fields = ('id', 'name', 'image', 'cooking_time')
+        fields = ('id', 'name', 'image', 'renditions', 'cooking_time')
 
 
 class SubcriptionSerializer(UserGetSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
+    recipes_count = serializers.ReadOnlyField()
 
     class Meta:
         model = User
@@ -100,67 +112,40 @@ class SubcriptionSerializer(UserGetSerializer):
         )
 
     def get_recipes(self, user):
-        request = self.context.get('request')
-        queryset = user.recipes
-        if request and not request.user.is_anonymous:
-            recipes_limit = request.query_params.get('recipes_limit')
+        if hasattr(user, 'latest_recipes'):
+            queryset = user.latest_recipes
+        else:
+            queryset = user.recipes.all()
+            recipes_limit = get_recipes_limit(self.context['request'])
             if recipes_limit:
-                try:
-                    queryset = queryset[:int(recipes_limit)]
-                except TypeError:
-                    pass
+                queryset = queryset[:recipes_limit]
         return RecipeMiniSerializer(
             queryset, many=True, context=self.context
         ).data
 
-    def get_recipes_count(self, user):
-        return user.recipes.count()
-
 
 class SubscriptionCreateSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Subscription
         fields = ('user', 'author')
+        read_only_fields = ('user', 'author')
 
     def validate(self, data):
-        request = self.context['request']
-        user = request.user
-        author = data.get('author')
-        if request.method == 'POST':
-            if author == user:
-                raise exceptions.ValidationError(
-                    ME_SUBSCRIPTION_VALIDATION_ERROR
-                )
-            if Subscription.objects.filter(
-                user=user, author=author
-            ).exists():
-                raise exceptions.ValidationError(
-                    RE_SUBSCRIPTION_VALIDATION_ERROR
-                )
-        if request.method == 'DELETE':
-            try:
-                Subscription.objects.get(
-                    author=author, user=user
-                )
-            except Subscription.DoesNotExist:
-                raise serializers.ValidationError(
-                    SUBSCRIPTION_NOT_FOUND_ERROR
-                )
+        if self.context['request'].user == self.context['author']:
+            raise exceptions.ValidationError(ME_SUBSCRIPTION_VALIDATION_ERROR)
         return data
 
     def to_representation(self, instance):
-        request = self.context.get('request')
+        instance.author.is_subscribed = True
         return SubcriptionSerializer(
-            instance=instance.user,
-            context={'request': request}
+            instance=instance.author,
+            context=self.context
         ).data
 
 
 class RecipeIngredientPostSerializer(serializers.ModelSerializer):
-    id = serializers.PrimaryKeyRelatedField(
-        queryset=Ingredient.objects.all(),
-    )
+    id = serializers.IntegerField(min_value=1)
     amount = serializers.IntegerField(
         write_only=True,
         min_value=Length.MIN_AMOUNT_OF_INGREDIENTS.value,
@@ -204,21 +189,32 @@ class RecipeGetSerializer(serializers.ModelSerializer):
     image = serializers.SerializerMethodField(
         method_name='get_image_url',
     )
+    renditions = ImageRenditionsField(source='image')
 
     class Meta:
         model = Recipe
         fields = (
             'id', 'tags', 'author', 'ingredients', 'name', 'text',
-            'cooking_time', 'image', 'is_favorited', 'is_in_shopping_cart'
+            'cooking_time', 'image', 'renditions', 'is_favorited',
+            'is_in_shopping_cart', 'favorites_count'
         )
 
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
+
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         return user.is_authenticated and user.favorite_user.filter(
             recipe=obj.id
         ).exists()
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         return user.is_authenticated and user.shopping_cart.filter(
             recipe=obj.id
@@ -228,12 +224,40 @@ class RecipeGetSerializer(serializers.ModelSerializer):
         return obj.image.url
 
 
+class PantryRecipeSerializer(RecipeGetSerializer):
+    """Рецепт из поиска по имеющимся ингредиентам.
+
+    Множество id имеющихся ингредиентов передаётся в context['pantry'].
+    """
+
+    matched_ingredients = serializers.SerializerMethodField()
+    missing_ingredients = serializers.SerializerMethodField()
+
+    class Meta(RecipeGetSerializer.Meta):
+        fields = RecipeGetSerializer.Meta.fields + (
+            'matched_ingredients', 'missing_ingredients'
+        )
+
+    def get_matched_ingredients(self, obj):
+        pantry = self.context['pantry']
+        return sum(
+            recipe_ingredient.ingredient_id in pantry
+            for recipe_ingredient in obj.ingredients_recipe.all()
+        )
+
+    def get_missing_ingredients(self, obj):
+        return (
+            len(obj.ingredients_recipe.all())
+            - self.get_matched_ingredients(obj)
+        )
+
+
 class RecipePostSerializer(serializers.ModelSerializer):
     ingredients = RecipeIngredientPostSerializer(
         many=True, required=True,
     )
-    tags = serializers.PrimaryKeyRelatedField(
-        queryset=Tag.objects.all(), many=True, required=True
+    tags = serializers.ListField(
+        child=serializers.IntegerField(min_value=1), required=True
     )
     image = Base64ImageField()
     author = UserGetSerializer(read_only=True)
@@ -269,6 +293,21 @@ class RecipePostSerializer(serializers.ModelSerializer):
             raise exceptions.ValidationError(
                 {'tags': 'Теги не могут повторяться.'}
             )
+        ingredients = Ingredient.objects.in_bulk(ingredient_ids)
+        tags = Tag.objects.in_bulk(tags_data)
+        errors = {}
+        for field, ids, found in (
+            ('ingredients', ingredient_ids, ingredients),
+            ('tags', tags_data, tags),
+        ):
+            missing = [str(pk) for pk in ids if pk not in found]
+            if missing:
+                errors[field] = NOT_FOUND_IDS_ERROR.format(', '.join(missing))
+        if errors:
+            raise exceptions.ValidationError(errors)
+        for ingredient in ingredients_data:
+            ingredient['id'] = ingredients[ingredient['id']]
+        data['tags'] = [tags[pk] for pk in tags_data]
         return data
 
     def create_ingredients_amounts(self, ingredients_data, recipe):
@@ -283,6 +322,7 @@ class RecipePostSerializer(serializers.ModelSerializer):
             )
         RecipeIngredient.objects.bulk_create(recipe_ingredients)
 
+    @transaction.atomic
     def create(self, validated_data):
         ingredients_data = validated_data.pop('ingredients')
         tags_data = validated_data.pop('tags')
@@ -292,19 +332,73 @@ class RecipePostSerializer(serializers.ModelSerializer):
         self.create_ingredients_amounts(ingredients_data, recipe)
         return recipe
 
+    def update_tags(self, tags, recipe):
+        """Приводит теги рецепта к новому списку, возвращает, были ли правки.
+
+        Запросов столько же, сколько у tags.set().
+        """
+        current = set(recipe.tags.values_list('pk', flat=True))
+        new = {tag.pk for tag in tags}
+        if current - new:
+            recipe.tags.remove(*(current - new))
+        if new - current:
+            recipe.tags.add(*(new - current))
+        return current != new
+
+    def update_ingredients_amounts(self, ingredients_data, recipe):
+        """Приводит ингредиенты рецепта к новому списку по разнице.
+
+        Изменённые количества обновляются одним UPDATE, а неизменные
+        строки не трогаются вовсе. Возвращает, были ли правки.
+        """
+        current = {
+            recipe_ingredient.ingredient_id: recipe_ingredient
+            for recipe_ingredient in recipe.ingredients_recipe.all()
+        }
+        amounts = {
+            ingredient['id'].id: ingredient['amount']
+            for ingredient in ingredients_data
+        }
+        removed = [
+            recipe_ingredient.pk
+            for ingredient_id, recipe_ingredient in current.items()
+            if ingredient_id not in amounts
+        ]
+        changed = []
+        created = []
+        for ingredient_id, amount in amounts.items():
+            recipe_ingredient = current.get(ingredient_id)
+            if recipe_ingredient is None:
+                created.append(RecipeIngredient(
+                    recipe=recipe, ingredient_id=ingredient_id, amount=amount
+                ))
+            elif recipe_ingredient.amount != amount:
+                recipe_ingredient.amount = amount
+                changed.append(recipe_ingredient)
+        if removed:
+            RecipeIngredient.objects.filter(pk__in=removed).delete()
+        if changed:
+            RecipeIngredient.objects.bulk_update(changed, ('amount',))
+        if created:
+            RecipeIngredient.objects.bulk_create(created)
+        return bool(removed or changed or created)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        tags_data = validated_data.pop('tags')
-        instance.tags.clear()
-        instance.tags.set(tags_data)
-        ingredients_data = validated_data.pop('ingredients')
-        ingredients_recipe = instance.ingredients_recipe.all()
-        ingredients_recipe.delete()
-        self.create_ingredients_amounts(
-            recipe=instance, ingredients_data=ingredients_data
+        tags_changed = self.update_tags(validated_data.pop('tags'), instance)
+        ingredients_changed = self.update_ingredients_amounts(
+            validated_data.pop('ingredients'), instance
         )
-        return super().update(instance, validated_data)
+        instance = super().update(instance, validated_data)
+        if tags_changed or ingredients_changed:
+            refresh_recipe_features(instance.pk)
+        return instance
 
     def to_representation(self, instance):
+        prefetch_related_objects([instance], 'tags', Prefetch(
+            'ingredients_recipe',
+            queryset=RecipeIngredient.objects.select_related('ingredient')
+        ))
         return RecipeGetSerializer(
             instance,
             context={'request': self.context.get('request')}
@@ -317,52 +411,54 @@ class FavoriteSerializer(serializers.ModelSerializer):
         model = Favorite
         fields = ('user', 'recipe')
 
-    def validate(self, data):
-        request = self.context['request']
-        user = request.user
-        recipe = data['recipe']
-        favorite = user.favorite_user.filter(
-            recipe=recipe
-        ).exists()
-        if request.method == 'POST' and favorite:
-            raise serializers.ValidationError(
-                'Рецепт уже в избранном'
-            )
-        if request.method == 'DELETE' and not favorite:
-            raise serializers.ValidationError(
-                'Ошибка. Рецепт уже был удалён.'
-            )
-        return data
-
     def to_representation(self, instance):
         return RecipeMiniSerializer(
             instance=instance.recipe,
         ).data
 
 
+class RecipeIdsSerializer(serializers.Serializer):
+    """Список id рецептов для массового добавления и удаления."""
+
+    recipes = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=BULK_RECIPES_LIMIT,
+    )
+
+    def validate_recipes(self, value):
+        return list(dict.fromkeys(value))
+
+
+class PantrySearchSerializer(serializers.Serializer):
+    """Параметры поиска рецептов по имеющимся ингредиентам."""
+
+    ingredients = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=PANTRY_INGREDIENTS_LIMIT,
+    )
+    missing = serializers.IntegerField(min_value=0, required=False)
+    tags = serializers.MultipleChoiceField(choices=(), required=False)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.fields['tags'].choices = tag_choices()
+
+    def validate_ingredients(self, value):
+        return set(value)
+
+    def validate_tags(self, value):
+        tag_ids = get_tag_ids()
+        return [tag_ids[slug] for slug in value]
+
+
 class ShoppingCartSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = ShoppingCart
         fields = ('user', 'recipe')
 
-    def validate(self, data):
-        request = self.context['request']
-        user = request.user
-        recipe = data['recipe']
-        shopping_cart = user.shopping_cart.filter(
-            recipe=recipe
-        ).exists()
-        if request.method == 'POST' and shopping_cart:
-            raise serializers.ValidationError(
-                'Рецепт уже в корзине'
-            )
-        if request.method == 'DELETE' and not shopping_cart:
-            raise serializers.ValidationError(
-                'Ошибка. Рецепт уже был удалён.'
-            )
-        return data
-
     def to_representation(self, instance):
         return RecipeMiniSerializer(
             instance=instance.recipe,
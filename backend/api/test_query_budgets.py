@@ -0,0 +1,126 @@
+from django.test import override_settings
+
+from .tests import LIST_URL, PNG, USERS_URL, FoodgramTestCase
+from core.middleware import QueryBudgetExceeded
+from recipes.models import Favorite, ShoppingCart
+from recipes.pantry import rebuild as rebuild_pantry_index
+from users.models import Subscription
+
+INGREDIENTS_URL = '/api/ingredients/'
+
+
+@override_settings(QUERY_BUDGETS_STRICT=True)
+class QueryBudgetsTest(FoodgramTestCase):
+    """Каждое действие с бюджетом укладывается в него на холодном кэше.
+
+    С QUERY_BUDGETS_STRICT превышение бюджета поднимает
+    QueryBudgetExceeded из RequestStatsMiddleware.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        author = cls.users[1]
+        Subscription.objects.create(user=cls.user, author=author)
+        Subscription.objects.create(user=cls.user, author=cls.users[2])
+        for recipe in cls.recipes[:4]:
+            Favorite.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def request(self, method, url, data=None, status=200, client=None):
+        client = client or self.client
+        try:
+            response = getattr(client, method)(url, data, format='json')
+            if response.streaming:
+                # Запросы при выдаче тела считаются, когда оно прочитано.
+                b''.join(response.streaming_content)
+        except QueryBudgetExceeded as error:
+            self.fail(str(error))
+        self.assertEqual(
+            response.status_code, status, getattr(response, 'data', None)
+        )
+        return response
+
+    def recipe_url(self, recipe, action=''):
+        return f'{LIST_URL}{recipe.pk}/{action}'
+
+    def test_recipes(self):
+        rebuild_pantry_index()
+        recipe = self.recipes[0]
+        other = self.recipes[-1]
+        for client in (self.anonymous, self.client):
+            self.request('get', LIST_URL, {'limit': 6}, client=client)
+            self.request(
+                'get', LIST_URL, {'tags': ['tag0', 'tag1']}, client=client
+            )
+            self.request('get', self.recipe_url(recipe), client=client)
+            self.request(
+                'get', self.recipe_url(recipe, 'similar/'), client=client
+            )
+            self.request('get', f'{LIST_URL}pantry/', {
+                'ingredients': [
+                    ingredient.pk for ingredient in self.ingredients[:4]
+                ],
+            }, client=client)
+        self.request('get', LIST_URL, {'is_favorited': 1})
+        self.request('get', LIST_URL, {'is_in_shopping_cart': 1})
+        self.request('get', f'{LIST_URL}feed/')
+        self.request(
+            'get', f'{LIST_URL}download_shopping_cart/', {'format': 'txt'}
+        )
+        created = self.request('post', LIST_URL, {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': PNG,
+            'tags': [tag.pk for tag in self.tags],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 2}
+                for ingredient in self.ingredients
+            ],
+        }, status=201)
+        self.request('patch', f'{LIST_URL}{created.data["id"]}/', {
+            'text': 'Другое описание',
+            'tags': [self.tags[0].pk],
+            'ingredients': [
+                {'id': ingredient.pk, 'amount': 3}
+                for ingredient in self.ingredients[:5]
+            ],
+        })
+        for action in ('favorite/', 'shopping_cart/'):
+            self.request(
+                'post', self.recipe_url(other, action), status=201
+            )
+            self.request(
+                'delete', self.recipe_url(other, action), status=204
+            )
+
+    def test_users(self):
+        author = self.users[1]
+        for client in (self.anonymous, self.client):
+            self.request('get', USERS_URL, client=client)
+            self.request('get', f'{USERS_URL}{author.pk}/', client=client)
+        self.request('get', f'{USERS_URL}me/')
+        self.request('get', f'{USERS_URL}subscriptions/', {
+            'recipes_limit': 2,
+        })
+        self.request(
+            'delete', f'{USERS_URL}{author.pk}/subscribe/', status=204
+        )
+        self.request(
+            'post', f'{USERS_URL}{author.pk}/subscribe/', status=201
+        )
+        self.request(
+            'delete', f'{USERS_URL}me/', {'current_password': 'password'},
+            status=204
+        )
+
+    def test_ingredients(self):
+        ingredient = self.ingredients[0]
+        for client in (self.anonymous, self.client):
+            self.request(
+                'get', INGREDIENTS_URL, {'name': 'Ингр'}, client=client
+            )
+            self.request(
+                'get', f'{INGREDIENTS_URL}{ingredient.pk}/', client=client
+            )
@@ -0,0 +1,30 @@
+from unittest import skipUnless
+
+from .query_plans import explain_queries, explain_supported
+from .tests import FoodgramTestCase
+from recipes.models import Favorite, ShoppingCart
+from recipes.similarity import build
+from users.models import Subscription
+
+
+@skipUnless(explain_supported(), 'EXPLAIN не поддерживается для этой СУБД.')
+class QueryPlansTest(FoodgramTestCase):
+    """Основные запросы API не читают большие таблицы целиком.
+
+    Та же проверка, что у команды check_query_plans, но на данных теста.
+    """
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for author in cls.users[1:]:
+            Subscription.objects.create(user=cls.user, author=author)
+        for recipe in cls.recipes[::2]:
+            Favorite.objects.create(user=cls.user, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+        build()
+
+    def test_no_sequential_scans(self):
+        for name, (plan, scans) in explain_queries(self.user).items():
+            with self.subTest(query=name):
+                self.assertEqual(scans, [], plan)
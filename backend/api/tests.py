@@ -0,0 +1,1163 @@
+import csv
+import io
+import json
+import os
+import re
+import shutil
+import tempfile
+from base64 import b64decode
+from unittest import mock, skipIf
+
+from django.core.cache import cache
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management import call_command
+from django.db import DEFAULT_DB_ALIAS, connection
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from PIL import Image
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+
+from api.authentication import local_tokens, token_cache_key
+from api.cache import LIST_VERSION_KEY, SHARED_VERSION_KEY, get_recipes
+from api.paginations import RANKED_CURSOR_ERROR
+from api.serializers import (
+    ME_SUBSCRIPTION_VALIDATION_ERROR, NOT_FOUND_IDS_ERROR,
+    RE_SUBSCRIPTION_VALIDATION_ERROR, RecipePostSerializer
+)
+from api.views import PANTRY_RETRY_AFTER
+from core.models import Job
+from core.routers import REPLICA_DB_ALIAS, ReplicaRouter
+from core.tasks import claim_jobs, run_job
+from core.versions import get_versions
+from recipes import pantry
+from recipes.images import RENDITIONS, RENDITIONS_DIR
+from recipes.models import (
+    Favorite, FeedEntry, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    Tag
+)
+from recipes.pantry import CHANGE_KEY, CHANGE_TIMEOUT, SEQUENCE_KEY
+from recipes.similarity import build
+from users.models import Subscription, User
+
+MEDIA_ROOT = tempfile.mkdtemp()
+LOCAL_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+}}
+LIST_URL = '/api/recipes/'
+DOWNLOAD_URL = '/api/recipes/download_shopping_cart/'
+USERS_URL = '/api/users/'
+WRITE = re.compile(
+    r'^\s*(INSERT\s+(?:OR\s+\w+\s+)?INTO|UPDATE|DELETE\s+FROM)\s+"?(\w+)"?',
+    re.IGNORECASE
+)
+RELATION_TABLES = {'recipes_recipeingredient', 'recipes_recipe_tags'}
+PNG = (
+    'data:image/png;base64,iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAAD'
+    'UlEQVR42mNk+M9QDwADhgGAWjR9awAAAABJRU5ErkJggg=='
+)
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, CACHES=LOCAL_CACHE)
+class FoodgramTestCase(TestCase):
+    """Пользователи, теги, ингредиенты и рецепты для тестов API."""
+
+    recipes_count = 12
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(
+                username=f'user{number}',
+                email=f'user{number}@example.com',
+                password='password',
+                first_name='Имя',
+                last_name='Фамилия',
+            )
+            for number in range(3)
+        ]
+        cls.user = cls.users[0]
+        cls.tags = [
+            Tag.objects.create(
+                name=f'Тег {number}', color=f'#00000{number}',
+                slug=f'tag{number}',
+            )
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(
+                name=f'Ингредиент {number}', measurement_unit='г'
+            )
+            for number in range(10)
+        ]
+        cls.recipes = []
+        for number in range(cls.recipes_count):
+            recipe = Recipe.objects.create(
+                name=f'Рецепт {number}',
+                text='Описание',
+                cooking_time=10,
+                author=cls.users[number % len(cls.users)],
+                image=ContentFile(b'image', name='recipe.png'),
+            )
+            recipe.tags.set(cls.tags[:1 + number % len(cls.tags)])
+            RecipeIngredient.objects.bulk_create(
+                RecipeIngredient(
+                    recipe=recipe,
+                    ingredient=cls.ingredients[
+                        (number + shift) % len(cls.ingredients)
+                    ],
+                    amount=shift + 1,
+                )
+                for shift in range(3)
+            )
+            cls.recipes.append(recipe)
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        cache.clear()
+        local_tokens.items.clear()
+        self.anonymous = APIClient()
+        self.client = self.client_for(self.user)
+
+    def client_for(self, user):
+        client = APIClient()
+        token, _ = Token.objects.get_or_create(user=user)
+        client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        return client
+
+    def recipe_data(self, recipe, **changes):
+        """Тело PATCH, повторяющее текущие теги и ингредиенты рецепта."""
+        return {
+            'tags': [tag.pk for tag in recipe.tags.all()],
+            'ingredients': [
+                {'id': row.ingredient_id, 'amount': row.amount}
+                for row in recipe.ingredients_recipe.all()
+            ],
+            **changes,
+        }
+
+
+class RecipeListQueriesTest(FoodgramTestCase):
+    """Число запросов списка рецептов не зависит от размера страницы."""
+
+    recipes_count = 110
+    # COUNT, страница рецептов, prefetch тегов и ингредиентов.
+    LIST_QUERIES = 4
+
+    def assert_list_queries(self, client, limit, queries):
+        with self.assertNumQueries(queries):
+            response = client.get(LIST_URL, {'limit': limit})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            len(response.data['results']), min(limit, self.recipes_count)
+        )
+
+    def assert_page_size_independent(self, client, first_queries,
+                                     cached_queries):
+        # Первый запрос дополнительно читает slug тегов для фильтра,
+        # а с токеном ещё и сам токен; дальше они берутся из кэша.
+        self.assert_list_queries(client, 1, first_queries)
+        for limit in (6, 100):
+            with self.subTest(limit=limit):
+                self.assert_list_queries(client, limit, self.LIST_QUERIES)
+                self.assert_list_queries(client, limit, cached_queries)
+
+    def test_anonymous(self):
+        # Из кэша страницы берётся всё, кроме числа добавлений
+        # в избранное.
+        self.assert_page_size_independent(
+            self.anonymous, self.LIST_QUERIES + 1, 1
+        )
+
+    def test_authenticated(self):
+        # И кроме трёх флагов пользователя.
+        self.assert_page_size_independent(
+            self.client, self.LIST_QUERIES + 2, 4
+        )
+
+
+class ShoppingCartDownloadTest(FoodgramTestCase):
+    """Список покупок из 10 000 строк ингредиентов во всех форматах."""
+
+    cart_recipes = 100
+    recipe_ingredients = 100
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        ingredients = [
+            Ingredient.objects.create(
+                name=f'Продукт {number:03}', measurement_unit=unit
+            )
+            for number in range(cls.recipe_ingredients)
+            for unit in ('г', 'кг')
+        ]
+        recipes = [
+            Recipe.objects.create(
+                name=f'Блюдо {number:03}',
+                text='Описание',
+                cooking_time=10,
+                author=cls.users[1],
+                image=ContentFile(b'image', name='recipe.png'),
+            )
+            for number in range(cls.cart_recipes)
+        ]
+        rows = [
+            RecipeIngredient(
+                recipe=recipe,
+                ingredient=ingredients[
+                    (number * 2 + position) % len(ingredients)
+                ],
+                amount=number % 7 + position % 5 + 1,
+            )
+            for number, recipe in enumerate(recipes)
+            for position in range(cls.recipe_ingredients)
+        ]
+        RecipeIngredient.objects.bulk_create(rows)
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.user, recipe=recipe) for recipe in recipes
+        )
+        ShoppingCart.objects.bulk_create(
+            ShoppingCart(user=cls.users[2], recipe=recipe)
+            for recipe in cls.recipes
+        )
+        grouped = {}
+        for row in rows:
+            key = (row.ingredient.name, row.ingredient.measurement_unit)
+            amount, names = grouped.setdefault(key, [0, []])
+            grouped[key][0] = amount + row.amount
+            names.append(row.recipe.name)
+        cls.expected = [
+            (name, unit, amount, sorted(names))
+            for (name, unit), (amount, names) in sorted(grouped.items())
+        ]
+
+    def download(self, file_format):
+        response = self.client.get(DOWNLOAD_URL, {'format': file_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode('utf-8')
+
+    def test_rows_count(self):
+        self.assertEqual(
+            RecipeIngredient.objects.filter(
+                recipe__shopping_cart__user=self.user
+            ).count(),
+            self.cart_recipes * self.recipe_ingredients
+        )
+
+    def test_txt(self):
+        self.assertEqual(self.download('txt').splitlines(), [
+            f'{name}: {amount} {unit} ({", ".join(recipes)})'
+            for name, unit, amount, recipes in self.expected
+        ])
+
+    def test_csv(self):
+        rows = list(csv.reader(io.StringIO(self.download('csv'))))
+        self.assertEqual(
+            rows[0], ['name', 'measurement_unit', 'amount', 'recipes']
+        )
+        self.assertEqual(rows[1:], [
+            [name, unit, str(amount), ', '.join(recipes)]
+            for name, unit, amount, recipes in self.expected
+        ])
+
+    def test_json(self):
+        self.assertEqual(json.loads(self.download('json')), [
+            {
+                'name': name,
+                'measurement_unit': unit,
+                'amount': amount,
+                'recipes': recipes,
+            }
+            for name, unit, amount, recipes in self.expected
+        ])
+
+
+class RecipeCacheInvalidationTest(FoodgramTestCase):
+    """Что сбрасывает кэш страниц рецептов, а что нет."""
+
+    def versions(self):
+        return get_versions(LIST_VERSION_KEY, SHARED_VERSION_KEY)
+
+    def test_favorite_keeps_list_cache(self):
+        recipe = self.recipes[-1]
+        self.anonymous.get(LIST_URL)
+        versions = self.versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client_for(self.users[1]).post(
+                f'{LIST_URL}{recipe.pk}/favorite/'
+            )
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(self.versions(), versions)
+        results = self.anonymous.get(LIST_URL).data['results']
+        self.assertEqual(results[0]['id'], recipe.pk)
+        self.assertEqual(results[0]['favorites_count'], 1)
+        self.assertIs(results[0]['is_favorited'], False)
+        self.assertIs(
+            self.client_for(self.users[1]).get(
+                LIST_URL
+            ).data['results'][0]['is_favorited'],
+            True
+        )
+
+    def test_signup_and_password_keep_cache(self):
+        versions = self.versions()
+        with self.captureOnCommitCallbacks(execute=True):
+            user = User.objects.create_user(
+                username='newcomer', email='newcomer@example.com',
+                password='password', first_name='Имя', last_name='Фамилия',
+            )
+            user = User.objects.get(pk=user.pk)
+            user.set_password('new-password')
+            user.save()
+            user.first_name = 'Имя'
+            user.save(update_fields=('first_name',))
+        self.assertEqual(self.versions(), versions)
+
+    def test_public_field_change_drops_cache(self):
+        versions = self.versions()
+        user = User.objects.get(pk=self.user.pk)
+        user.first_name = 'Другое'
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        changed = self.versions()
+        self.assertNotEqual(changed[SHARED_VERSION_KEY],
+                            versions[SHARED_VERSION_KEY])
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        self.assertEqual(self.versions(), changed)
+
+
+class RecordingReplicaRouter(ReplicaRouter):
+    """Реплика с бесконечным отставанием: запоминает, что с неё читали.
+
+    Все чтения на самом деле идут в основную базу теста.
+    """
+
+    reads = []
+
+    def db_for_read(self, model, **hints):
+        if super().db_for_read(model, **hints) == REPLICA_DB_ALIAS:
+            self.reads.append(model)
+        return DEFAULT_DB_ALIAS
+
+
+@override_settings(DATABASE_ROUTERS=['api.tests.RecordingReplicaRouter'])
+@mock.patch('api.mixins.replica_reads_allowed', return_value=True)
+class ReplicaCacheTest(FoodgramTestCase):
+    """Кэш ответов не строится по отставшей реплике."""
+
+    def setUp(self):
+        super().setUp()
+        RecordingReplicaRouter.reads = []
+
+    def test_cache_is_built_on_primary(self, replica_reads_allowed):
+        recipe = Recipe.objects.create(
+            name='Только что созданный', text='Описание', cooking_time=10,
+            author=self.user, image=ContentFile(b'image', name='recipe.png'),
+        )
+        for url in (LIST_URL, f'{LIST_URL}{recipe.pk}/'):
+            with self.subTest(url=url):
+                response = self.anonymous.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertNotIn(Recipe, RecordingReplicaRouter.reads)
+                self.assertIn(
+                    recipe.pk, [data['id'] for data in get_recipes(
+                        response.data
+                    )]
+                )
+                # Из кэша реплика читает только свежие счётчики.
+                self.anonymous.get(url)
+                self.assertIn(Recipe, RecordingReplicaRouter.reads)
+                RecordingReplicaRouter.reads = []
+
+
+class RecipeUpdateJobsTest(FoodgramTestCase):
+    """Правка рецепта ставит в очередь только нужные задачи."""
+
+    def patch(self, **changes):
+        recipe = self.recipes[0]
+        Job.objects.all().delete()
+        response = self.client.patch(
+            f'{LIST_URL}{recipe.pk}/', self.recipe_data(recipe, **changes),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return set(Job.objects.values_list('name', flat=True))
+
+    def test_text_only(self):
+        self.assertEqual(self.patch(text='Новое описание'), set())
+
+    def test_image(self):
+        self.assertEqual(
+            self.patch(image=PNG),
+            {'recipes.tasks.build_recipe_renditions'}
+        )
+
+    def test_tags(self):
+        self.assertEqual(
+            self.patch(tags=[tag.pk for tag in self.tags]),
+            {'recipes.tasks.refresh_similar_recipes'}
+        )
+
+    def test_ingredients(self):
+        self.assertEqual(
+            self.patch(ingredients=[
+                {'id': self.ingredients[-1].pk, 'amount': 5}
+            ]),
+            {'recipes.tasks.refresh_similar_recipes'}
+        )
+
+
+class BulkActionsTest(FoodgramTestCase):
+    """Массовое добавление и удаление в избранное и список покупок."""
+
+    ENDPOINTS = {
+        'shopping_cart': (ShoppingCart, 'in_carts_count'),
+        'favorite': (Favorite, 'favorites_count'),
+    }
+
+    def bulk(self, method, url, recipe_ids):
+        response = getattr(self.client, method)(
+            url, {'recipes': recipe_ids}, format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        return [(row['id'], row['status']) for row in response.data]
+
+    def counters(self, counter):
+        return dict(Recipe.objects.values_list('pk', counter))
+
+    def test_add_and_remove(self):
+        first, second, third = (recipe.pk for recipe in self.recipes[:3])
+        for path, (model, counter) in self.ENDPOINTS.items():
+            with self.subTest(path):
+                url = f'{LIST_URL}{path}/'
+                self.assertEqual(
+                    self.bulk('post', url, [first, second, second, 999]),
+                    [(first, 'created'), (second, 'created'),
+                     (999, 'not_found')]
+                )
+                self.assertEqual(
+                    self.bulk('post', url, [first, third]),
+                    [(first, 'exists'), (third, 'created')]
+                )
+                counters = self.counters(counter)
+                self.assertEqual(
+                    [counters[pk] for pk in (first, second, third)],
+                    [1, 1, 1]
+                )
+                self.assertEqual(
+                    self.bulk('delete', url, [first, first, 999]),
+                    [(first, 'deleted'), (999, 'not_found')]
+                )
+                self.assertEqual(
+                    self.bulk('delete', url, [first, second]),
+                    [(first, 'not_found'), (second, 'deleted')]
+                )
+                counters = self.counters(counter)
+                self.assertEqual(
+                    [counters[pk] for pk in (first, second, third)],
+                    [0, 0, 1]
+                )
+                self.assertEqual(
+                    list(model.objects.filter(user=self.user).values_list(
+                        'recipe_id', flat=True
+                    )),
+                    [third]
+                )
+
+
+class RecipePostValidationTest(FoodgramTestCase):
+    """Теги и ингредиенты рецепта проверяются одним запросом на модель."""
+
+    def recipe(self, ingredient_ids, tag_ids):
+        return {
+            'name': 'Новый рецепт',
+            'text': 'Описание',
+            'cooking_time': 5,
+            'image': PNG,
+            'ingredients': [
+                {'id': pk, 'amount': 10} for pk in ingredient_ids
+            ],
+            'tags': tag_ids,
+        }
+
+    def test_queries(self):
+        serializer = RecipePostSerializer(data=self.recipe(
+            [ingredient.pk for ingredient in self.ingredients],
+            [tag.pk for tag in self.tags],
+        ))
+        with self.assertNumQueries(2):
+            self.assertTrue(serializer.is_valid(), serializer.errors)
+        self.assertEqual(serializer.validated_data['tags'], self.tags)
+        self.assertEqual([
+            ingredient['id']
+            for ingredient in serializer.validated_data['ingredients']
+        ], self.ingredients)
+
+    def test_unknown_ids(self):
+        response = self.client.post(LIST_URL, self.recipe(
+            [self.ingredients[0].pk, 998, 999], [self.tags[0].pk, 997]
+        ), format='json')
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(response.json(), {
+            'ingredients': [NOT_FOUND_IDS_ERROR.format('998, 999')],
+            'tags': [NOT_FOUND_IDS_ERROR.format('997')],
+        })
+        self.assertFalse(Recipe.objects.filter(name='Новый рецепт').exists())
+
+
+class RecipeRenditionsTest(FoodgramTestCase):
+    """Варианты изображения строятся задачей и попадают в ответ API."""
+
+    def renditions(self, recipe):
+        response = self.anonymous.get(f'{LIST_URL}{recipe.pk}/')
+        self.assertEqual(response.status_code, 200)
+        renditions = response.data['renditions']
+        self.assertEqual(set(renditions), set(RENDITIONS) | {
+            f'{rendition}_webp' for rendition in RENDITIONS
+        })
+        return response.data['image'], renditions
+
+    def test_original_until_built(self):
+        recipe = self.recipes[0]
+        Job.objects.all().delete()
+        response = self.client.patch(
+            f'{LIST_URL}{recipe.pk}/', self.recipe_data(recipe, image=PNG),
+            format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        image, renditions = self.renditions(recipe)
+        self.assertEqual(
+            set(renditions.values()), {f'http://testserver{image}'}
+        )
+        with self.captureOnCommitCallbacks(execute=True):
+            job = run_job(Job.objects.get(
+                name='recipes.tasks.build_recipe_renditions'
+            ))
+        self.assertEqual(job.status, Job.DONE)
+        renditions = self.renditions(recipe)[1]
+        for key, url in renditions.items():
+            with self.subTest(key=key):
+                name = url[url.index(RENDITIONS_DIR):]
+                self.assertEqual(url, f'http://testserver/media/{name}')
+                with default_storage.open(name) as file:
+                    self.assertEqual(
+                        Image.open(file).format,
+                        'WEBP' if key.endswith('_webp') else 'PNG'
+                    )
+
+
+class SubscribeTest(FoodgramTestCase):
+    """Ошибки подписки отдаются в том же виде, что у избранного."""
+
+    def subscribe(self, author):
+        return self.client.post(f'/api/users/{author.pk}/subscribe/')
+
+    def test_subscribe(self):
+        response = self.subscribe(self.users[1])
+        self.assertEqual(response.status_code, 201)
+        self.assertIs(response.data['is_subscribed'], True)
+
+    def test_subscribe_twice(self):
+        self.subscribe(self.users[1])
+        response = self.subscribe(self.users[1])
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {'errors': RE_SUBSCRIPTION_VALIDATION_ERROR}
+        )
+
+    def test_subscribe_to_self(self):
+        response = self.subscribe(self.user)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(),
+            {'non_field_errors': [ME_SUBSCRIPTION_VALIDATION_ERROR]}
+        )
+
+
+class InactiveUserTest(FoodgramTestCase):
+    """Удалённый, но ещё не стёртый пользователь скрыт из /users/."""
+
+    def setUp(self):
+        super().setUp()
+        self.author = self.users[1]
+        User.objects.filter(pk=self.author.pk).update(is_active=False)
+
+    def test_hidden(self):
+        response = self.client.get(USERS_URL, {'limit': 100})
+        self.assertEqual(response.status_code, 200)
+        self.assertNotIn(
+            self.author.pk, [user['id'] for user in response.data['results']]
+        )
+        response = self.client.get(f'{USERS_URL}{self.author.pk}/')
+        self.assertEqual(response.status_code, 404)
+
+    def test_subscribe(self):
+        response = self.client.post(
+            f'{USERS_URL}{self.author.pk}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 404)
+        self.assertFalse(Subscription.objects.exists())
+
+
+class SubscriptionListTest(FoodgramTestCase):
+    """Список подписок: число запросов и recipes_limit."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for author in cls.users[1:]:
+            Subscription.objects.create(user=cls.user, author=author)
+
+    def subscriptions(self, queries, **params):
+        with self.assertNumQueries(queries):
+            response = self.client.get(f'{USERS_URL}subscriptions/', params)
+        self.assertEqual(response.status_code, 200)
+        return response.data['results']
+
+    def latest_recipe_ids(self, author, limit=None):
+        recipes = [
+            recipe.pk for recipe in reversed(self.recipes)
+            if recipe.author_id == author['id']
+        ]
+        return recipes[:limit]
+
+    def test_queries_do_not_depend_on_authors(self):
+        # Токен, COUNT, авторы с флагом подписки и рецепты всех авторов.
+        self.subscriptions(4)
+        author = User.objects.create_user(
+            username='author', email='author@example.com', password='password'
+        )
+        Subscription.objects.create(user=self.user, author=author)
+        self.assertEqual(len(self.subscriptions(3)), len(self.users))
+
+    def test_recipes_limit(self):
+        for author in self.subscriptions(4, recipes_limit=2):
+            with self.subTest(author=author['username']):
+                self.assertIs(author['is_subscribed'], True)
+                self.assertEqual(author['recipes_count'], 4)
+                self.assertEqual(
+                    [recipe['id'] for recipe in author['recipes']],
+                    self.latest_recipe_ids(author, 2)
+                )
+
+    def test_invalid_recipes_limit(self):
+        self.subscriptions(4)
+        for recipes_limit in ('abc', '0', '-1'):
+            with self.subTest(recipes_limit=recipes_limit):
+                for author in self.subscriptions(
+                    3, recipes_limit=recipes_limit
+                ):
+                    self.assertEqual(
+                        [recipe['id'] for recipe in author['recipes']],
+                        self.latest_recipe_ids(author)
+                    )
+
+
+class FeedTest(FoodgramTestCase):
+    """Лента подписок: раскладка, подмешивание популярных авторов, курсор."""
+
+    FEED_URL = f'{LIST_URL}feed/'
+
+    def setUp(self):
+        super().setUp()
+        Job.objects.all().delete()
+
+    def subscribe(self, author, client=None, method='post'):
+        response = getattr(client or self.client, method)(
+            f'{USERS_URL}{author.pk}/subscribe/'
+        )
+        self.assertLess(response.status_code, 300)
+
+    def run_jobs(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for job in claim_jobs(100):
+                self.assertEqual(run_job(job).status, Job.DONE)
+
+    def publish(self, author):
+        recipe = Recipe.objects.create(
+            name='Новый рецепт', text='Описание', cooking_time=10,
+            author=author, image=ContentFile(
+                b64decode(PNG.split(',')[1]), name='recipe.png'
+            ),
+        )
+        self.run_jobs()
+        return recipe
+
+    def entries(self, user=None):
+        return set(FeedEntry.objects.filter(
+            user=user or self.user
+        ).values_list('recipe_id', flat=True))
+
+    def feed(self, limit=100):
+        ids = []
+        url = f'{self.FEED_URL}?limit={limit}'
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        return ids
+
+    def expected(self, *authors):
+        return [
+            recipe.pk for recipe in Recipe.objects.filter(
+                author__in=authors
+            ).order_by('-pub_date', '-id')
+        ]
+
+    def test_backfill_and_trim(self):
+        author = self.users[1]
+        self.subscribe(author)
+        self.assertEqual(self.entries(), set(self.expected(author)))
+        self.assertEqual(self.feed(), self.expected(author))
+        self.subscribe(author, method='delete')
+        self.assertEqual(self.entries(), set())
+        self.assertEqual(self.feed(), [])
+
+    def test_fan_out(self):
+        author = self.users[1]
+        self.subscribe(author)
+        recipe = self.publish(author)
+        self.assertIn(recipe.pk, self.entries())
+        self.assertEqual(self.feed()[0], recipe.pk)
+
+    def test_cursor_paging(self):
+        for author in self.users[1:]:
+            self.subscribe(author)
+        self.assertEqual(self.feed(limit=3), self.expected(*self.users[1:]))
+
+    @mock.patch('recipes.feed.FAN_OUT_FOLLOWERS_LIMIT', 2)
+    def test_popular_author(self):
+        author = self.users[1]
+        followers = [
+            self.client_for(user) for user in (
+                self.users[2],
+                User.objects.create_user(
+                    username='reader', email='reader@example.com',
+                    password='password',
+                ),
+            )
+        ]
+        for client in followers:
+            self.subscribe(author, client=client)
+        self.subscribe(author)
+        self.assertEqual(self.entries(), set())
+        recipe = self.publish(author)
+        self.assertNotIn(recipe.pk, self.entries(self.users[2]))
+        self.assertEqual(self.feed(limit=3), self.expected(author))
+        # Отписки возвращают автора под порог, и рецепт, вышедший,
+        # пока он был популярным, раскладывается по лентам.
+        for client in followers:
+            self.subscribe(author, client=client, method='delete')
+        self.run_jobs()
+        self.assertEqual(self.entries(), set(self.expected(author)))
+        self.assertEqual(self.feed(limit=3), self.expected(author))
+
+
+class SimilarRecipesTest(FoodgramTestCase):
+    """Похожие рецепты после полной сборки и после правки рецепта."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        build()
+
+    def similar(self, recipe):
+        response = self.anonymous.get(f'{LIST_URL}{recipe.pk}/similar/')
+        self.assertEqual(response.status_code, 200)
+        return [data['id'] for data in response.data]
+
+    def test_refresh_after_edit(self):
+        recipe, target = self.recipes[0], self.recipes[5]
+        self.assertNotIn(target.pk, self.similar(recipe))
+        Job.objects.all().delete()
+        response = self.client.patch(
+            f'{LIST_URL}{recipe.pk}/',
+            self.recipe_data(target, name=recipe.name), format='json'
+        )
+        self.assertEqual(response.status_code, 200)
+        with self.captureOnCommitCallbacks(execute=True):
+            for job in claim_jobs(10):
+                self.assertEqual(run_job(job).status, Job.DONE)
+        self.assertEqual(self.similar(recipe)[0], target.pk)
+        self.assertIn(recipe.pk, self.similar(target))
+
+
+class PantryTest(FoodgramTestCase):
+    """Поиск по продуктам и обновление индекса процесса."""
+
+    PANTRY_URL = f'{LIST_URL}pantry/'
+
+    def setUp(self):
+        super().setUp()
+        patchers = (
+            mock.patch.object(pantry, '_index', None),
+            mock.patch('recipes.pantry.start_rebuild'),
+        )
+        self.start_rebuild = [patcher.start() for patcher in patchers][1]
+        for patcher in patchers:
+            self.addCleanup(patcher.stop)
+        self.query = [self.ingredients[number].pk for number in (0, 1, 2, 5)]
+
+    def search(self, status=200, **params):
+        response = self.anonymous.get(self.PANTRY_URL, {
+            'ingredients': self.query, 'limit': 100, **params
+        })
+        self.assertEqual(response.status_code, status)
+        if status != 200:
+            return response
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def expected(self, missing=None, tags=()):
+        tag_ids = {tag.pk for tag in self.tags if tag.slug in tags}
+        found = []
+        for recipe in Recipe.objects.prefetch_related(
+            'ingredients_recipe', 'tags'
+        ):
+            ingredients = {
+                row.ingredient_id for row in recipe.ingredients_recipe.all()
+            }
+            matched = len(ingredients & set(self.query))
+            if not matched:
+                continue
+            if missing is not None and len(ingredients) - matched > missing:
+                continue
+            if tag_ids and not tag_ids & {
+                tag.pk for tag in recipe.tags.all()
+            }:
+                continue
+            found.append((matched, recipe.pk))
+        return [pk for _, pk in sorted(found, reverse=True)]
+
+    def change_recipe(self):
+        recipe = self.recipes[3]
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.patch(
+                f'{LIST_URL}{recipe.pk}/',
+                self.recipe_data(recipe, ingredients=[
+                    {'id': pk, 'amount': 1} for pk in self.query
+                ]),
+                format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        return recipe
+
+    def test_results(self):
+        pantry.rebuild()
+        cases = {
+            'all': {},
+            'missing 0': {'missing': 0},
+            'missing 1': {'missing': 1},
+            'tag': {'tags': ['tag2']},
+        }
+        for name, params in cases.items():
+            with self.subTest(name):
+                self.assertEqual(
+                    self.search(**params), self.expected(**params)
+                )
+
+    def test_cold_process(self):
+        response = self.search(status=503)
+        self.assertEqual(response['Retry-After'], str(PANTRY_RETRY_AFTER))
+        self.start_rebuild.assert_called_once_with()
+        pantry.rebuild()
+        self.assertEqual(self.search(), self.expected())
+
+    def test_incremental_change(self):
+        index = pantry.rebuild()
+        recipe = self.change_recipe()
+        self.assertEqual(self.search(missing=0)[0], recipe.pk)
+        self.assertEqual(self.search(missing=0), self.expected(missing=0))
+        self.assertIs(pantry._index, index)
+        self.start_rebuild.assert_not_called()
+
+    def test_log_gap(self):
+        pantry.rebuild()
+        stale = self.expected(missing=0)
+        recipe = self.change_recipe()
+        cache.delete(CHANGE_KEY.format(cache.get(SEQUENCE_KEY)))
+        # Пока индекс строится в фоне, отдаётся прежний.
+        self.assertEqual(self.search(missing=0), stale)
+        self.assertNotIn(recipe.pk, stale)
+        self.start_rebuild.assert_called_once_with()
+        pantry.rebuild()
+        self.assertEqual(self.search(missing=0), self.expected(missing=0))
+
+    def test_sequence_evicted(self):
+        with mock.patch('recipes.pantry.cache') as shared:
+            shared.incr.side_effect = [ValueError, 7]
+            shared.add.return_value = True
+            pantry.record_change(self.recipes[0].pk)
+        self.assertEqual(shared.add.call_args_list[-1], mock.call(
+            CHANGE_KEY.format(7), self.recipes[0].pk, CHANGE_TIMEOUT
+        ))
+
+
+class RecipeUpdateWritesTest(FoodgramTestCase):
+    """PATCH пишет в таблицы связей рецепта только разницу."""
+
+    def patch_writes(self, **changes):
+        """Возвращает множество (операция, таблица) записей в связи."""
+        recipe = self.recipes[0]
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.patch(
+                f'{LIST_URL}{recipe.pk}/',
+                self.recipe_data(recipe, **changes), format='json'
+            )
+        self.assertEqual(response.status_code, 200)
+        writes = set()
+        for query in queries.captured_queries:
+            match = WRITE.match(query['sql'])
+            if match and match[2] in RELATION_TABLES:
+                writes.add((match[1].split()[0].upper(), match[2]))
+        return writes, response.data
+
+    def amounts(self, data):
+        return {
+            ingredient['id']: ingredient['amount']
+            for ingredient in data['ingredients']
+        }
+
+    def test_text_only(self):
+        writes, data = self.patch_writes(text='Новое описание')
+        self.assertEqual(writes, set())
+        self.assertEqual(data['text'], 'Новое описание')
+
+    def test_add(self):
+        writes, data = self.patch_writes(
+            ingredients=[
+                {'id': row.ingredient_id, 'amount': row.amount}
+                for row in self.recipes[0].ingredients_recipe.all()
+            ] + [{'id': self.ingredients[-1].pk, 'amount': 7}],
+            tags=[tag.pk for tag in self.tags],
+        )
+        self.assertEqual(writes, {
+            ('INSERT', 'recipes_recipeingredient'),
+            ('INSERT', 'recipes_recipe_tags'),
+        })
+        self.assertEqual(self.amounts(data)[self.ingredients[-1].pk], 7)
+        self.assertEqual(len(data['tags']), len(self.tags))
+
+    def test_change(self):
+        rows = list(self.recipes[0].ingredients_recipe.all())
+        writes, data = self.patch_writes(ingredients=[
+            {'id': row.ingredient_id, 'amount': row.amount + 10}
+            for row in rows
+        ])
+        self.assertEqual(writes, {('UPDATE', 'recipes_recipeingredient')})
+        self.assertEqual(self.amounts(data), {
+            row.ingredient_id: row.amount + 10 for row in rows
+        })
+
+    def test_remove(self):
+        self.recipes[0].tags.add(*self.tags)
+        rows = list(self.recipes[0].ingredients_recipe.all())
+        writes, data = self.patch_writes(
+            ingredients=[
+                {'id': row.ingredient_id, 'amount': row.amount}
+                for row in rows[:1]
+            ],
+            tags=[self.tags[0].pk],
+        )
+        self.assertEqual(writes, {
+            ('DELETE', 'recipes_recipeingredient'),
+            ('DELETE', 'recipes_recipe_tags'),
+        })
+        self.assertEqual(self.amounts(data), {
+            rows[0].ingredient_id: rows[0].amount
+        })
+        self.assertEqual([tag['id'] for tag in data['tags']], [
+            self.tags[0].pk
+        ])
+
+
+class RecipeTagFilterTest(FoodgramTestCase):
+    """Фильтр по нескольким тегам не размножает рецепты."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        for recipe in cls.recipes[::2]:
+            Favorite.objects.create(user=cls.user, recipe=recipe)
+        for recipe in cls.recipes[::3]:
+            ShoppingCart.objects.create(user=cls.user, recipe=recipe)
+
+    def filtered_ids(self, **params):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(LIST_URL, {'limit': 100, **params})
+        self.assertEqual(response.status_code, 200)
+        for query in queries.captured_queries:
+            self.assertNotIn('DISTINCT', query['sql'].upper())
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_overlapping_tags_with_user_filters(self):
+        slugs = [tag.slug for tag in self.tags]
+        cases = {
+            'tags': ({}, self.recipes),
+            'favorites': ({'is_favorited': 1}, self.recipes[::2]),
+            'shopping cart': (
+                {'is_in_shopping_cart': 1}, self.recipes[::3]
+            ),
+            'both': (
+                {'is_favorited': 1, 'is_in_shopping_cart': 1},
+                self.recipes[::6]
+            ),
+        }
+        for name, (params, expected) in cases.items():
+            with self.subTest(name):
+                ids = self.filtered_ids(tags=slugs[1:], **params)
+                self.assertEqual(len(ids), len(set(ids)))
+                self.assertEqual(set(ids), {
+                    recipe.pk for recipe in expected
+                    if len(recipe.tags.all()) > 1
+                })
+
+    def test_loaded_tags_are_filterable(self):
+        self.client.get(LIST_URL, {'tags': 'tag0'})
+        path = os.path.join(MEDIA_ROOT, 'tags.json')
+        with open(path, 'w', encoding='utf-8') as file:
+            json.dump([
+                {'name': 'Новый', 'color': '#123456', 'slug': 'new'}
+            ], file)
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('load_catalog', 'tags', path, stdout=io.StringIO())
+        recipe = self.recipes[0]
+        recipe.tags.add(Tag.objects.get(slug='new'))
+        self.assertEqual(self.filtered_ids(tags='new'), [recipe.pk])
+
+
+@skipIf(connection.vendor == 'postgresql', 'Поиск без PostgreSQL')
+class RecipeSearchTest(FoodgramTestCase):
+    """Поиск без PostgreSQL: icontains и тот же порядок выдачи."""
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        cls.found = {}
+        for name, text in (
+            ('Borscht', 'Описание'),
+            ('Суп', 'Почти borscht'),
+            ('Green BORSCHT', 'Описание'),
+            ('Щи', 'Тоже BORSCHT'),
+        ):
+            cls.found[name] = Recipe.objects.create(
+                name=name, text=text, cooking_time=10, author=cls.user,
+                image=ContentFile(b'image', name='recipe.png'),
+            ).pk
+
+    def search_ids(self, text):
+        response = self.anonymous.get(
+            LIST_URL, {'search': text, 'limit': 100}
+        )
+        self.assertEqual(response.status_code, 200)
+        return [recipe['id'] for recipe in response.data['results']]
+
+    def test_name_matches_first(self):
+        found = self.found
+        self.assertEqual(self.search_ids('borscht'), [
+            found['Green BORSCHT'], found['Borscht'],
+            found['Щи'], found['Суп'],
+        ])
+
+    def test_blank_search(self):
+        self.assertEqual(
+            len(self.search_ids(' ')), len(self.recipes) + len(self.found)
+        )
+        self.assertEqual(self.search_ids('nothing'), [])
+
+
+class RecipeCursorTest(FoodgramTestCase):
+    """Режим курсора в списке рецептов."""
+
+    def test_pages_follow_list_order(self):
+        ids = []
+        url = f'{LIST_URL}?cursor=&limit=5'
+        while url:
+            response = self.anonymous.get(url)
+            self.assertEqual(response.status_code, 200)
+            self.assertNotIn('count', response.data)
+            ids += [recipe['id'] for recipe in response.data['results']]
+            url = response.data['next']
+        self.assertEqual(ids, [
+            recipe.pk for recipe in sorted(
+                self.recipes, key=lambda recipe: (recipe.pub_date, recipe.pk),
+                reverse=True
+            )
+        ])
+
+    def test_cursor_with_search(self):
+        response = self.anonymous.get(
+            LIST_URL, {'search': 'Рецепт', 'cursor': ''}
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {'cursor': [RANKED_CURSOR_ERROR]}
+        )
+
+
+class RequestStatsTest(FoodgramTestCase):
+    """Статистика запроса в логе и в заголовке Server-Timing."""
+
+    def test_server_timing_hidden(self):
+        response = self.client.get(f'{USERS_URL}me/')
+        self.assertNotIn('Server-Timing', response)
+
+    def test_server_timing_for_staff(self):
+        User.objects.filter(pk=self.user.pk).update(is_staff=True)
+        response = self.client.get(f'{USERS_URL}me/')
+        self.assertIn('queries', response['Server-Timing'])
+
+    @override_settings(DEBUG=True)
+    def test_server_timing_in_debug(self):
+        response = self.anonymous.get(LIST_URL)
+        self.assertIn('queries', response['Server-Timing'])
+
+    def test_streaming_queries(self):
+        ShoppingCart.objects.create(user=self.user, recipe=self.recipes[0])
+        with self.assertLogs('foodgram.requests', 'INFO') as logs:
+            response = self.client.get(DOWNLOAD_URL)
+            self.assertEqual(logs.records, [])
+            content = b''.join(response.streaming_content).decode()
+        self.assertIn(self.ingredients[0].name, content)
+        # Токен и ингредиенты, которые читаются уже при выдаче тела.
+        self.assertEqual([record.queries for record in logs.records], [2])
+
+
+class TokenCacheTest(FoodgramTestCase):
+    """Общий кэш токенов хранит только id пользователя."""
+
+    def me(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = self.client.get(f'{USERS_URL}me/')
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.data['id'], self.user.pk)
+        return [query['sql'] for query in queries.captured_queries]
+
+    def test_tiers(self):
+        key = Token.objects.get(user=self.user).key
+        queries = self.me()
+        self.assertIn('authtoken_token', queries[0])
+        self.assertEqual(cache.get(token_cache_key(key)), self.user.pk)
+        self.assertEqual(len(self.me()), len(queries) - 1)
+        local_tokens.items.clear()
+        queries = self.me()
+        self.assertNotIn('authtoken_token', ' '.join(queries))
+        self.assertIn('users_user', queries[0])
+
+    def test_password_change_drops_token(self):
+        self.me()
+        user = User.objects.get(pk=self.user.pk)
+        user.set_password('new-password')
+        with self.captureOnCommitCallbacks(execute=True):
+            user.save()
+        key = Token.objects.get(user=self.user).key
+        self.assertIsNone(cache.get(token_cache_key(key)))
+        self.assertIn('authtoken_token', self.me()[0])
@@ -1,7 +1,11 @@
-from django.db.models import Sum
+from functools import partial
+
+from django.db import transaction
+from django.db.models import Prefetch
 from django.shortcuts import get_object_or_404
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.serializers import SetPasswordSerializer
+from djoser.utils import logout_user
 from djoser.views import UserViewSet
 from rest_framework import status
 from rest_framework.decorators import action
@@ -9,33 +13,68 @@ from rest_framework.generics import ListAPIView
 from rest_framework.permissions import (
     IsAuthenticated, SAFE_METHODS, IsAuthenticatedOrReadOnly
 )
+from rest_framework.renderers import JSONRenderer
 from rest_framework.response import Response
 from rest_framework.viewsets import (
     ReadOnlyModelViewSet, ModelViewSet
 )
+from .cache import cached_recipes, detail_cache_key, list_cache_key
 from .filters import IngredientFilter, RecipeFilter
-from .paginations import FoodgramPagination
+from .mixins import QueryBudgetMixin, ReplicaReadMixin
+from .paginations import FoodgramPagination, RecipePagination
 from .permissions import IsAuthorOrReadOnly
+from .renderers import CSVRenderer, PlainTextRenderer
 from .serializers import (
     UserGetSerializer, UserCreatesSerializer,
     FavoriteSerializer, IngredientSerializer,
     TagSerializer, SubcriptionSerializer, ShoppingCartSerializer,
-    SubscriptionCreateSerializer,
-    RecipePostSerializer, RecipeGetSerializer
+    SubscriptionCreateSerializer, RecipeIdsSerializer, RecipeMiniSerializer,
+    RecipePostSerializer, RecipeGetSerializer, PantryRecipeSerializer,
+    PantrySearchSerializer, RE_SUBSCRIPTION_VALIDATION_ERROR,
+    SUBSCRIPTION_NOT_FOUND_ERROR
 )
 from core.utils import (
-    create_list_of_shopping_cart, create_object, delete_object
+    bulk_create_objects, bulk_delete_objects, create_object, create_unique,
+    delete_object, get_recipes_limit, stream_shopping_cart
 )
 from recipes.models import (
     Favorite, Ingredient, Recipe, Tag, ShoppingCart, RecipeIngredient
 )
+from recipes.feed import get_feed_ids
+from recipes.pantry import PantryIndexNotReady, get_pantry_index
+from recipes.search import get_ingredient_index
 from users.models import User, Subscription
+from users.tasks import delete_user
+
+PANTRY_NOT_READY_ERROR = 'Поиск по продуктам готовится, повторите позже.'
+PANTRY_RETRY_AFTER = 5
 
 
-class UsersViewSet(UserViewSet):
-    queryset = User.objects.all()
+class UsersViewSet(QueryBudgetMixin, ReplicaReadMixin, UserViewSet):
+    # Удаление пользователя только снимает is_active, данные стирает
+    # фоновая задача delete_user. До этого пользователя нет в /users/,
+    # его профиль отвечает 404 и на него нельзя подписаться.
+    queryset = User.objects.filter(is_active=True)
     serializer_class = UserGetSerializer
     pagination_class = FoodgramPagination
+    query_budgets = {
+        'list': 4,
+        'retrieve': 3,
+        'me': 3,
+        'me.delete': 10,
+        'subscribe': 10,
+    }
+
+    def get_queryset(self):
+        return super().get_queryset().with_is_subscribed(self.request.user)
+
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        if instance == self.request.user:
+            logout_user(self.request)
+        instance.is_active = False
+        instance.save(update_fields=('is_active',))
+        delete_user.delay(instance.pk)
 
     def get_permissions(self):
         if self.action == 'me':
@@ -47,35 +86,46 @@ class UsersViewSet(UserViewSet):
         methods=('POST', 'DELETE'),
         permission_classes=(IsAuthenticated,)
     )
+    @transaction.atomic
     def subscribe(self, request, **kwargs):
-        author_id = self.kwargs.get('id')
-        author = get_object_or_404(User, id=author_id)
-        author.save()
+        author = get_object_or_404(self.queryset, id=self.kwargs.get('id'))
         user = request.user
-        serializer = SubscriptionCreateSerializer(
-            data={
-                'user': user.id,
-                'author': author.id
-            },
-            context={'request': request}
-        )
         if request.method == 'POST':
+            context = {'request': request, 'author': author}
+            serializer = SubscriptionCreateSerializer(
+                data={}, context=context
+            )
             serializer.is_valid(raise_exception=True)
-            serializer.save()
+            subscription = create_unique(
+                Subscription, user=user, author=author
+            )
+            if subscription is None:
+                return Response(
+                    {'errors': RE_SUBSCRIPTION_VALIDATION_ERROR},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
             return Response(
-                serializer.data,
+                SubscriptionCreateSerializer(
+                    subscription, context=context
+                ).data,
                 status=status.HTTP_201_CREATED)
-        subscription = get_object_or_404(
-            Subscription,
-            user=user,
-            author=author
-        )
-        subscription.delete()
+        deleted, _ = Subscription.objects.filter(
+            user=user, author=author
+        ).delete()
+        if not deleted:
+            return Response(
+                {'errors': SUBSCRIPTION_NOT_FOUND_ERROR},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         return Response(status=status.HTTP_204_NO_CONTENT)
 
     def get_serializer_class(self):
         if self.action == 'create':
             return UserCreatesSerializer
+        if self.request.method == 'DELETE' and self.action in (
+            'destroy', 'me'
+        ):
+            return super().get_serializer_class()
         return UserGetSerializer
 
     @action(detail=False, methods=['POST'])
@@ -95,37 +145,96 @@ class UsersViewSet(UserViewSet):
                         status=status.HTTP_400_BAD_REQUEST)
 
 
-class SubscriptionListView(ListAPIView):
+class SubscriptionListView(QueryBudgetMixin, ListAPIView):
     serializer_class = SubcriptionSerializer
     pagination_class = FoodgramPagination
-    permission_classes = (IsAuthenticatedOrReadOnly,)
+    permission_classes = (IsAuthenticated,)
+    query_budgets = {'get': 5}
 
     def get_queryset(self):
+        user = self.request.user
+        recipes = Recipe.objects.all()
+        recipes_limit = get_recipes_limit(self.request)
+        if recipes_limit:
+            recipes = recipes.latest_per_author(recipes_limit)
         return User.objects.filter(
-            subscription__user=self.request.user
+            subscription__user=user
+        ).with_is_subscribed(user).prefetch_related(
+            Prefetch('recipes', queryset=recipes, to_attr='latest_recipes')
         )
 
 
-class IngredientViewSet(ReadOnlyModelViewSet):
+class IngredientViewSet(
+    QueryBudgetMixin, ReplicaReadMixin, ReadOnlyModelViewSet
+):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
     pagination_class = None
+    query_budgets = {'list': 2, 'retrieve': 2}
 
+    def list(self, request, *args, **kwargs):
+        index = get_ingredient_index()
+        name = request.query_params.get('name')
+        if name is None:
+            return Response(index.rows)
+        return Response(index.search(name))
 
-class TagViewSet(ReadOnlyModelViewSet):
+
+class TagViewSet(ReplicaReadMixin, ReadOnlyModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
 
 
-class RecipeViewSet(ModelViewSet):
+class RecipeViewSet(QueryBudgetMixin, ReplicaReadMixin, ModelViewSet):
     queryset = Recipe.objects.select_related('author')
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     permission_classes = IsAuthorOrReadOnly, IsAuthenticatedOrReadOnly
-    pagination_class = FoodgramPagination
+    pagination_class = RecipePagination
+    query_budgets = {
+        'list': 8,
+        'retrieve': 8,
+        'create': 20,
+        'partial_update': 24,
+        'favorite': 8,
+        'shopping_cart': 8,
+        'download_shopping_cart': 2,
+        'feed': 8,
+        'similar': 3,
+        'pantry': 7,
+    }
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve', 'feed', 'pantry'):
+            return queryset
+        return queryset.prefetch_related(
+            'tags',
+            Prefetch(
+                'ingredients_recipe',
+                queryset=RecipeIngredient.objects.select_related('ingredient')
+            )
+        ).with_user_flags(self.request.user)
+
+    def cached_response(self, key, build):
+        if key is None:
+            return build()
+        return Response(cached_recipes(key, self.request.user, build))
+
+    def list(self, request, *args, **kwargs):
+        return self.cached_response(
+            list_cache_key(request),
+            partial(super().list, request, *args, **kwargs)
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_response(
+            detail_cache_key(kwargs['pk']),
+            partial(super().retrieve, request, *args, **kwargs)
+        )
 
     def perform_create(self, serializer):
         serializer.save(author=self.request.user)
@@ -135,6 +244,57 @@ class RecipeViewSet(ModelViewSet):
             return RecipePostSerializer
         return RecipeGetSerializer
 
+    def feed_page(self, position, limit):
+        recipe_ids = get_feed_ids(self.request.user, position, limit)
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        return [recipes[pk] for pk in recipe_ids if pk in recipes]
+
+    @action(detail=False, permission_classes=(IsAuthenticated,))
+    def feed(self, request):
+        page = self.paginator.paginate_cursor(request, self.feed_page)
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def pantry_page(self, index, search, offset, limit):
+        recipe_ids = index.search(
+            search['ingredients'], search.get('missing'),
+            search.get('tags', ()), offset, limit
+        )
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        return [recipes[pk] for pk in recipe_ids if pk in recipes]
+
+    @action(detail=False)
+    def pantry(self, request):
+        search = PantrySearchSerializer(data=request.query_params)
+        search.is_valid(raise_exception=True)
+        try:
+            index = get_pantry_index()
+        except PantryIndexNotReady:
+            return Response(
+                {'errors': PANTRY_NOT_READY_ERROR},
+                status=status.HTTP_503_SERVICE_UNAVAILABLE,
+                headers={'Retry-After': str(PANTRY_RETRY_AFTER)},
+            )
+        page = self.paginator.paginate_ranked(
+            request, partial(self.pantry_page, index, search.validated_data)
+        )
+        serializer = PantryRecipeSerializer(page, many=True, context={
+            **self.get_serializer_context(),
+            'pantry': search.validated_data['ingredients'],
+        })
+        return self.get_paginated_response(serializer.data)
+
+    @action(detail=True)
+    def similar(self, request, pk=None):
+        recipe = get_object_or_404(Recipe.objects.only('id'), pk=pk)
+        recipes = Recipe.objects.filter(
+            similar_to__recipe=recipe
+        ).order_by('-similar_to__score')
+        serializer = RecipeMiniSerializer(
+            recipes, many=True, context={'request': request}
+        )
+        return Response(serializer.data)
+
     @action(
         detail=True,
         methods=('POST', 'DELETE'),
@@ -155,17 +315,50 @@ class RecipeViewSet(ModelViewSet):
             return create_object(request, pk, FavoriteSerializer)
         return delete_object(Favorite, request, pk)
 
+    def bulk_action(self, request, model, counter):
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = serializer.validated_data['recipes']
+        if request.method == 'POST':
+            return bulk_create_objects(
+                request, recipe_ids, model, RecipeMiniSerializer, counter
+            )
+        return bulk_delete_objects(request, recipe_ids, model)
+
     @action(
         detail=False,
-        permission_classes=(IsAuthenticated,)
+        methods=('POST', 'DELETE'),
+        permission_classes=(IsAuthenticated,),
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk',
+    )
+    def shopping_cart_bulk(self, request):
+        return self.bulk_action(request, ShoppingCart, 'in_carts_count')
+
+    @action(
+        detail=False,
+        methods=('POST', 'DELETE'),
+        permission_classes=(IsAuthenticated,),
+        url_path='favorite',
+        url_name='favorite-bulk',
+    )
+    def favorite_bulk(self, request):
+        return self.bulk_action(request, Favorite, 'favorites_count')
+
+    @action(
+        detail=False,
+        permission_classes=(IsAuthenticated,),
+        renderer_classes=(PlainTextRenderer, CSVRenderer, JSONRenderer)
     )
     def download_shopping_cart(self, request):
         ingredients = RecipeIngredient.objects.filter(
             recipe__shopping_cart__user=request.user
-        ).values(
-            'ingredient__name', 'ingredient__measurement_unit'
-        ).annotate(
-            total_qty=Sum('amount')
+        ).order_by(
+            'ingredient__name', 'ingredient__measurement_unit', 'recipe__name'
+        ).values_list(
+            'ingredient__name', 'ingredient__measurement_unit',
+            'amount', 'recipe__name'
+        ).iterator()
+        return stream_shopping_cart(
+            ingredients, request.accepted_renderer.format
         )
-
-        return create_list_of_shopping_cart(ingredients)
@@ -0,0 +1,228 @@
+import json
+import tracemalloc
+from datetime import datetime, timezone
+from statistics import quantiles
+from time import perf_counter
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.core.management import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+
+from recipes.models import Ingredient, Recipe, Tag
+from recipes.pantry import rebuild as rebuild_pantry_index
+from users.models import User
+
+PERCENTILES = (50, 95, 99)
+
+
+def get_routes():
+    """Маршруты API на чтение: (имя, URL, нужна ли авторизация)."""
+    recipe = Recipe.objects.order_by('-id').first()
+    ingredient = Ingredient.objects.order_by('id').first()
+    tag = Tag.objects.order_by('id').first()
+    user = User.objects.order_by('id').first()
+    if None in (recipe, ingredient, tag, user):
+        raise CommandError(
+            'Нет данных для замеров, сначала выполните generate_dataset.'
+        )
+    ingredient_ids = list(recipe.ingredients_recipe.values_list(
+        'ingredient_id', flat=True
+    ))
+    return (
+        ('recipes-list', reverse('api:recipes-list'), False),
+        (
+            'recipes-list-tags',
+            reverse('api:recipes-list') + f'?tags={tag.slug}',
+            False,
+        ),
+        (
+            'recipes-list-author',
+            reverse('api:recipes-list') + f'?author={recipe.author_id}',
+            False,
+        ),
+        (
+            'recipes-list-search',
+            reverse('api:recipes-list') + '?' + urlencode(
+                {'search': ingredient.name}
+            ),
+            False,
+        ),
+        (
+            'recipes-list-cursor',
+            reverse('api:recipes-list') + '?cursor=',
+            False,
+        ),
+        (
+            'recipes-list-favorited',
+            reverse('api:recipes-list') + '?is_favorited=1',
+            True,
+        ),
+        (
+            'recipes-list-in-cart',
+            reverse('api:recipes-list') + '?is_in_shopping_cart=1',
+            True,
+        ),
+        (
+            'recipes-detail',
+            reverse('api:recipes-detail', args=(recipe.id,)),
+            False,
+        ),
+        (
+            'recipes-similar',
+            reverse('api:recipes-similar', args=(recipe.id,)),
+            False,
+        ),
+        (
+            'recipes-pantry',
+            reverse('api:recipes-pantry') + '?' + urlencode(
+                {'ingredients': ingredient_ids, 'missing': 2}, doseq=True
+            ),
+            False,
+        ),
+        (
+            'recipes-download-shopping-cart',
+            reverse('api:recipes-download-shopping-cart'),
+            True,
+        ),
+        ('users-list', reverse('api:users-list'), False),
+        ('users-detail', reverse('api:users-detail', args=(user.id,)), False),
+        ('users-me', reverse('api:users-me'), True),
+        (
+            'subscription-list',
+            reverse('api:subscription-list') + '?recipes_limit=3',
+            True,
+        ),
+        ('ingredients-list', reverse('api:ingredients-list'), False),
+        (
+            'ingredients-search',
+            reverse('api:ingredients-list') + '?' + urlencode(
+                {'name': ingredient.name[:2]}
+            ),
+            False,
+        ),
+        (
+            'ingredients-detail',
+            reverse('api:ingredients-detail', args=(ingredient.id,)),
+            False,
+        ),
+        ('tags-list', reverse('api:tags-list'), False),
+        ('tags-detail', reverse('api:tags-detail', args=(tag.id,)), False),
+    )
+
+
+class Command(BaseCommand):
+    help = (
+        'Замеряет задержку, число запросов к БД и память для маршрутов '
+        'API через тестовый клиент и сохраняет результат в JSON.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--output', default='bench_api.json')
+        parser.add_argument(
+            '--compare', help='JSON предыдущего замера для сравнения.'
+        )
+        parser.add_argument(
+            '--cold', action='store_true',
+            help='Очищать кэш перед каждым запросом.',
+        )
+
+    def handle(self, *args, **options):
+        user = User.objects.filter(
+            is_active=True, subscriber__isnull=False
+        ).first() or User.objects.filter(is_active=True).first()
+        clients = {'anonymous': Client()}
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            clients['authenticated'] = Client(
+                HTTP_AUTHORIZATION=f'Token {token.key}'
+            )
+        # В gunicorn индекс продуктов строится в фоне при старте
+        # процесса, здесь его нужно построить до замеров.
+        rebuild_pantry_index()
+        results = []
+        with override_settings(ALLOWED_HOSTS=['*']):
+            for name, url, auth_required in get_routes():
+                for mode, client in clients.items():
+                    if auth_required and mode == 'anonymous':
+                        continue
+                    results.append(self.measure(
+                        name, url, mode, client, options
+                    ))
+        report = {
+            'created': datetime.now(timezone.utc).isoformat(),
+            'iterations': options['iterations'],
+            'cold': options['cold'],
+            'routes': results,
+        }
+        with open(options['output'], 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        for result in results:
+            self.stdout.write(
+                '{route} [{mode}] {status}: p50 {p50_ms:.1f} ms, '
+                'p95 {p95_ms:.1f} ms, p99 {p99_ms:.1f} ms, '
+                '{queries} запросов, {peak_kb:.0f} КБ'.format(**result)
+            )
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def measure(self, name, url, mode, client, options):
+        timings = []
+        queries = 0
+        for _ in range(max(options['iterations'], 2)):
+            if options['cold']:
+                cache.clear()
+            with CaptureQueriesContext(connection) as context:
+                started = perf_counter()
+                response = client.get(url)
+                if response.streaming:
+                    b''.join(response.streaming_content)
+                timings.append((perf_counter() - started) * 1000)
+            queries = len(context.captured_queries)
+        if options['cold']:
+            cache.clear()
+        tracemalloc.start()
+        client.get(url)
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        cuts = quantiles(timings, n=100)
+        return {
+            'route': name,
+            'mode': mode,
+            'url': url,
+            'status': response.status_code,
+            **{
+                f'p{percentile}_ms': round(cuts[percentile - 1], 3)
+                for percentile in PERCENTILES
+            },
+            'queries': queries,
+            'peak_kb': round(peak / 1024, 1),
+        }
+
+    def compare(self, path, results):
+        with open(path, encoding='utf-8') as file:
+            previous = {
+                (result['route'], result['mode']): result
+                for result in json.load(file)['routes']
+            }
+        self.stdout.write(f'Сравнение с {path}:')
+        for result in results:
+            old = previous.get((result['route'], result['mode']))
+            if old is None:
+                continue
+            self.stdout.write(
+                '{route} [{mode}]: p95 {old:.1f} -> {new:.1f} ms, '
+                'запросов {old_queries} -> {new_queries}'.format(
+                    route=result['route'],
+                    mode=result['mode'],
+                    old=old['p95_ms'],
+                    new=result['p95_ms'],
+                    old_queries=old['queries'],
+                    new_queries=result['queries'],
+                )
+            )
@@ -0,0 +1,90 @@
+from concurrent.futures import ThreadPoolExecutor
+from time import monotonic, sleep
+
+from django.core.management import BaseCommand
+from django.db import close_old_connections
+from django.utils.module_loading import autodiscover_modules
+
+from core.tasks import (
+    KEEP_DONE_DAYS, MAINTENANCE_INTERVAL, STALE_TIMEOUT, claim_jobs,
+    prune_done_jobs, requeue_stale_jobs, run_job
+)
+
+
+def run_in_thread(job):
+    try:
+        return run_job(job)
+    finally:
+        close_old_connections()
+
+
+class Command(BaseCommand):
+    help = 'Выполняет фоновые задачи из таблицы Job.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--threads', type=int, default=4)
+        parser.add_argument('--poll-interval', type=float, default=1.0)
+        parser.add_argument(
+            '--once', action='store_true',
+            help='Выполнить готовые задачи и завершиться.'
+        )
+        parser.add_argument(
+            '--keep-days', type=int, default=KEEP_DONE_DAYS,
+            help='Сколько дней хранить выполненные задачи.'
+        )
+
+    def handle(self, *args, **options):
+        autodiscover_modules('tasks')
+        self.maintained_at = None
+        if options['threads'] <= 1:
+            self.run_inline(options)
+        else:
+            self.run_pool(options)
+
+    def maintain(self, options):
+        """Раз в MAINTENANCE_INTERVAL секунд обслуживает таблицу задач.
+
+        Возвращает в очередь задачи, зависшие у упавших воркеров,
+        и чистит выполненные. Вызывается на каждом шаге цикла, чтобы
+        работать и тогда, когда очередь не пустеет.
+        """
+        if (
+            self.maintained_at is not None
+            and monotonic() - self.maintained_at < MAINTENANCE_INTERVAL
+        ):
+            return
+        self.maintained_at = monotonic()
+        requeue_stale_jobs(STALE_TIMEOUT)
+        prune_done_jobs(options['keep_days'])
+
+    def idle(self, options):
+        close_old_connections()
+        sleep(options['poll_interval'])
+
+    def run_inline(self, options):
+        while True:
+            self.maintain(options)
+            jobs = claim_jobs(1)
+            for job in jobs:
+                run_job(job)
+            if jobs:
+                continue
+            if options['once']:
+                return
+            self.idle(options)
+
+    def run_pool(self, options):
+        threads = options['threads']
+        running = set()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            while True:
+                running = {future for future in running if not future.done()}
+                self.maintain(options)
+                jobs = claim_jobs(threads - len(running))
+                for job in jobs:
+                    running.add(pool.submit(run_in_thread, job))
+                if jobs:
+                    continue
+                if options['once'] and not running:
+                    return
+                self.idle(options)
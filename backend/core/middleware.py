@@ -0,0 +1,182 @@
+import logging
+from contextlib import ExitStack
+from time import perf_counter
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured, MiddlewareNotUsed
+from django.db import connections
+
+from .routers import (
+    replica_configured, shared_cache_configured, stick_to_primary
+)
+
+logger = logging.getLogger('foodgram.requests')
+
+QUERY_BUDGET_ERROR = '{view}: {queries} запросов к БД при бюджете {budget}.'
+REPLICA_CACHE_ERROR = (
+    'Для реплики базы нужен кэш, общий для всех процессов: отметка '
+    'о записи пользователя должна быть видна каждому воркеру. '
+    'Задайте CACHE_BACKEND, отличный от LocMemCache и DummyCache.'
+)
+SAFE_METHODS = ('GET', 'HEAD', 'OPTIONS')
+# Управление транзакциями зависит от того, вложен ли atomic, и от СУБД
+# (SQLite шлёт BEGIN запросом), поэтому в бюджет не входит.
+TRANSACTION_STATEMENTS = (
+    'BEGIN', 'SAVEPOINT', 'RELEASE SAVEPOINT', 'ROLLBACK TO SAVEPOINT'
+)
+
+
+class QueryBudgetExceeded(Exception):
+    """Представление выполнило больше запросов, чем заявлено."""
+
+
+class RequestStats:
+    """Счётчики одного запроса: запросы к БД и время по этапам.
+
+    Экземпляр подключается к соединениям как execute_wrapper, а имя
+    представления, бюджет и время сериализации заполняет QueryBudgetMixin.
+    """
+
+    def __init__(self):
+        self.queries = 0
+        self.db_time = 0.0
+        self.serialize_time = None
+        self.render_time = None
+        self.view = None
+        self.budget = None
+        self.auth_cache = None
+
+    def __call__(self, execute, sql, params, many, context):
+        started = perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            if not sql.startswith(TRANSACTION_STATEMENTS):
+                self.queries += 1
+            self.db_time += perf_counter() - started
+
+    def set_render_time(self, started, response):
+        self.render_time = perf_counter() - started
+
+    def timings(self, total):
+        timings = {'db': self.db_time}
+        if self.serialize_time is not None:
+            timings['serialize'] = self.serialize_time
+        if self.render_time is not None:
+            timings['render'] = self.render_time
+        timings['total'] = total
+        return {name: value * 1000 for name, value in timings.items()}
+
+    def over_budget(self):
+        return self.budget is not None and self.queries > self.budget
+
+
+class RequestStatsMiddleware:
+    """Считает запросы к БД и время обработки каждого запроса.
+
+    Итог пишется в лог строкой вида key=value, а при DEBUG или для
+    персонала отдаётся и в заголовке Server-Timing. Превышение бюджета
+    запросов логируется, а при QUERY_BUDGETS_STRICT = True приводит
+    к исключению. У потоковых ответов в итог входят и запросы, которые
+    выполняются при выдаче тела, поэтому он подводится после неё,
+    а в заголовок попадает только время до начала выдачи.
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        stats = request.stats = RequestStats()
+        started = perf_counter()
+        with self.count_queries(stats):
+            response = self.get_response(request)
+        if show_server_timing(request):
+            response['Server-Timing'] = server_timing(
+                stats, stats.timings(perf_counter() - started)
+            )
+        if response.streaming:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, stats, started
+            )
+            return response
+        self.finish(request, response, stats, started)
+        return response
+
+    def count_queries(self, stats):
+        stack = ExitStack()
+        for connection in connections.all():
+            stack.enter_context(connection.execute_wrapper(stats))
+        return stack
+
+    def stream(self, content, request, response, stats, started):
+        with self.count_queries(stats):
+            yield from content
+        self.finish(request, response, stats, started)
+
+    def finish(self, request, response, stats, started):
+        timings = stats.timings(perf_counter() - started)
+        logger.info(
+            'method=%s path=%s view=%s status=%s queries=%s auth_cache=%s %s',
+            request.method, request.path, stats.view, response.status_code,
+            stats.queries, stats.auth_cache,
+            ' '.join(
+                f'{name}_ms={value:.1f}' for name, value in timings.items()
+            ),
+            extra={
+                'queries': stats.queries,
+                'view': stats.view,
+                'auth_cache': stats.auth_cache,
+                **timings,
+            },
+        )
+        if stats.over_budget():
+            message = QUERY_BUDGET_ERROR.format(
+                view=stats.view, queries=stats.queries, budget=stats.budget
+            )
+            if getattr(settings, 'QUERY_BUDGETS_STRICT', False):
+                raise QueryBudgetExceeded(message)
+            logger.warning(message)
+
+
+def show_server_timing(request):
+    """Server-Timing раскрывает число запросов, поэтому он не для всех."""
+    if settings.DEBUG:
+        return True
+    user = getattr(request, 'user', None)
+    return user is not None and user.is_staff
+
+
+def server_timing(stats, timings):
+    return ', '.join(
+        f'{name};dur={value:.1f}' + (
+            f';desc="{stats.queries} queries"' if name == 'db' else ''
+        )
+        for name, value in timings.items()
+    )
+
+
+class ReplicaStickinessMiddleware:
+    """Закрепляет пользователя за основной базой после его записи.
+
+    Подключается только вместе с репликой в settings.DATABASES
+    и отказывается запускаться с кэшем, локальным для процесса.
+    """
+
+    def __init__(self, get_response):
+        if not replica_configured():
+            raise MiddlewareNotUsed
+        if not shared_cache_configured():
+            raise ImproperlyConfigured(REPLICA_CACHE_ERROR)
+        self.get_response = get_response
+
+    def __call__(self, request):
+        response = self.get_response(request)
+        user = getattr(request, 'user', None)
+        if (
+            request.method not in SAFE_METHODS
+            and response.status_code < 400
+            and user is not None
+            and user.is_authenticated
+        ):
+            stick_to_primary(user)
+        return response
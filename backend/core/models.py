@@ -0,0 +1,104 @@
+from django.db import models
+
+
+class ChangedFieldsMixin:
+    """Запоминает значения полей, загруженные из базы или сохранённые.
+
+    Позволяет обработчикам сигналов отличать реальное изменение поля
+    от повторного сохранения того же значения.
+    """
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.loaded_values = dict(zip(field_names, values))
+        return instance
+
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        deferred = self.get_deferred_fields()
+        self.loaded_values = {
+            field.attname: field.value_from_object(self)
+            for field in self._meta.concrete_fields
+            if field.attname not in deferred
+        }
+
+    def changed_fields(self, fields):
+        """Поля из fields, значения которых отличаются от запомненных.
+
+        Незагруженные поля и поля нового объекта считаются изменёнными.
+        """
+        loaded = getattr(self, 'loaded_values', {})
+        return {
+            field for field in fields
+            if field not in loaded or loaded[field] != getattr(self, field)
+        }
+
+
+class Job(models.Model):
+    """Отложенная задача, которую выполняет run_worker."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = [
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    ]
+
+    name = models.CharField(
+        verbose_name='Задача',
+        max_length=200,
+    )
+    args = models.JSONField(
+        verbose_name='Аргументы',
+        default=list,
+    )
+    kwargs = models.JSONField(
+        verbose_name='Именованные аргументы',
+        default=dict,
+    )
+    status = models.CharField(
+        verbose_name='Статус',
+        max_length=10,
+        choices=STATUSES,
+        default=QUEUED,
+    )
+    attempts = models.PositiveSmallIntegerField(
+        verbose_name='Попыток',
+        default=0,
+    )
+    max_attempts = models.PositiveSmallIntegerField(
+        verbose_name='Максимум попыток',
+        default=3,
+    )
+    run_at = models.DateTimeField(
+        verbose_name='Запустить не раньше',
+    )
+    last_error = models.TextField(
+        verbose_name='Последняя ошибка',
+        blank=True,
+    )
+    created_at = models.DateTimeField(
+        verbose_name='Создана',
+        auto_now_add=True,
+    )
+    updated_at = models.DateTimeField(
+        verbose_name='Обновлена',
+        auto_now=True,
+    )
+
+    class Meta:
+        verbose_name = 'Задача'
+        verbose_name_plural = 'Задачи'
+        ordering = ('run_at',)
+        indexes = [models.Index(
+            fields=('status', 'run_at'),
+            name='job_status_run_at_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.name} ({self.status})'
@@ -0,0 +1,85 @@
+from contextlib import contextmanager
+from contextvars import ContextVar
+
+from django.conf import settings
+from django.core.cache import DEFAULT_CACHE_ALIAS, cache, caches
+from django.core.cache.backends.dummy import DummyCache
+from django.core.cache.backends.locmem import LocMemCache
+from django.db import DEFAULT_DB_ALIAS
+
+REPLICA_DB_ALIAS = 'replica'
+
+_replica_reads = ContextVar('replica_reads', default=False)
+
+
+def replica_configured():
+    return REPLICA_DB_ALIAS in settings.DATABASES
+
+
+def shared_cache_configured():
+    """Видят ли записи кэша все процессы, а не только текущий."""
+    return not isinstance(
+        caches[DEFAULT_CACHE_ALIAS], (DummyCache, LocMemCache)
+    )
+
+
+def sticky_key(user_id):
+    return f'db:primary:{user_id}'
+
+
+def stick_to_primary(user):
+    """Направляет чтение пользователя на основную базу после записи.
+
+    Пока реплика догоняет основную базу, пользователь должен видеть
+    собственные изменения.
+    """
+    cache.set(sticky_key(user.pk), True, settings.REPLICA_STICKY_SECONDS)
+
+
+def replica_reads_allowed(user):
+    if not replica_configured():
+        return False
+    return not (user.is_authenticated and cache.get(sticky_key(user.pk)))
+
+
+def enable_replica_reads():
+    return _replica_reads.set(True)
+
+
+def reset_replica_reads(token):
+    _replica_reads.reset(token)
+
+
+@contextmanager
+def primary_reads():
+    """Читает внутри блока с основной базы, даже если запрос читает с реплики.
+
+    Нужно для данных, которые переживают запрос: отставшая реплика
+    не должна попасть в кэш на всё время его жизни.
+    """
+    token = _replica_reads.set(False)
+    try:
+        yield
+    finally:
+        _replica_reads.reset(token)
+
+
+class ReplicaRouter:
+    """Отправляет чтение на реплику там, где его разрешил запрос.
+
+    Всё остальное, включая запись и миграции, идёт в основную базу.
+    """
+
+    def db_for_read(self, model, **hints):
+        if _replica_reads.get():
+            return REPLICA_DB_ALIAS
+        return DEFAULT_DB_ALIAS
+
+    def db_for_write(self, model, **hints):
+        return DEFAULT_DB_ALIAS
+
+    def allow_relation(self, obj1, obj2, **hints):
+        return True
+
+    def allow_migrate(self, db, app_label, **hints):
+        return db != REPLICA_DB_ALIAS
@@ -0,0 +1,104 @@
+import traceback
+from datetime import timedelta
+
+from django.utils import timezone
+
+from .models import Job
+
+RETRY_DELAY = 30
+STALE_TIMEOUT = 60 * 60
+KEEP_DONE_DAYS = 7
+MAINTENANCE_INTERVAL = 10 * 60
+
+registry = {}
+
+
+def background(func=None, *, max_attempts=3):
+    """Регистрирует функцию как фоновую задачу.
+
+    func.delay(*args, **kwargs) сохраняет задачу в таблицу Job
+    в текущей транзакции, выполняет её команда run_worker. Аргументы
+    должны сериализоваться в JSON.
+    """
+    def decorator(func):
+        name = f'{func.__module__}.{func.__qualname__}'
+        registry[name] = func
+
+        def delay(*args, **kwargs):
+            return Job.objects.create(
+                name=name,
+                args=list(args),
+                kwargs=kwargs,
+                max_attempts=max_attempts,
+                run_at=timezone.now(),
+            )
+
+        func.delay = delay
+        return func
+
+    if func is not None:
+        return decorator(func)
+    return decorator
+
+
+def claim_jobs(limit):
+    """Помечает готовые к запуску задачи как выполняемые и возвращает их.
+
+    Задача достаётся тому воркеру, чей UPDATE с условием на статус
+    изменил строку, поэтому несколько воркеров не возьмут одну задачу.
+    """
+    candidates = Job.objects.filter(
+        status=Job.QUEUED, run_at__lte=timezone.now()
+    ).values_list('pk', flat=True)[:limit]
+    claimed = []
+    for pk in candidates:
+        if Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+            status=Job.RUNNING, updated_at=timezone.now()
+        ):
+            claimed.append(pk)
+    return list(Job.objects.filter(pk__in=claimed))
+
+
+def run_job(job):
+    """Выполняет задачу, при ошибке откладывает повтор с нарастающей паузой."""
+    try:
+        func = registry[job.name]
+        func(*job.args, **job.kwargs)
+    except Exception:
+        job.attempts += 1
+        job.last_error = traceback.format_exc()
+        if job.attempts < job.max_attempts:
+            job.status = Job.QUEUED
+            job.run_at = timezone.now() + timedelta(
+                seconds=RETRY_DELAY * 2 ** (job.attempts - 1)
+            )
+        else:
+            job.status = Job.FAILED
+    else:
+        job.attempts += 1
+        job.status = Job.DONE
+    job.save(update_fields=(
+        'status', 'attempts', 'run_at', 'last_error', 'updated_at'
+    ))
+    return job
+
+
+def requeue_stale_jobs(timeout):
+    """Возвращает в очередь задачи, зависшие после падения воркера."""
+    return Job.objects.filter(
+        status=Job.RUNNING,
+        updated_at__lt=timezone.now() - timedelta(seconds=timeout),
+    ).update(status=Job.QUEUED, run_at=timezone.now())
+
+
+def prune_done_jobs(days):
+    """Удаляет выполненные задачи старше days дней.
+
+    Упавшие задачи остаются в таблице для разбора. Возраст считается
+    по run_at, чтобы удаление шло по индексу (status, run_at).
+    """
+    deleted, _ = Job.objects.filter(
+        status=Job.DONE,
+        run_at__lt=timezone.now() - timedelta(days=days),
+    ).delete()
+    return deleted
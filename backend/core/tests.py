@@ -0,0 +1,84 @@
+from datetime import timedelta
+from unittest import mock
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.management import call_command
+from django.test import SimpleTestCase, TestCase, override_settings
+from django.utils import timezone
+
+from .management.commands.run_worker import Command as RunWorkerCommand
+from .middleware import ReplicaStickinessMiddleware
+from .models import Job
+from .tasks import (
+    MAINTENANCE_INTERVAL, STALE_TIMEOUT, background, prune_done_jobs
+)
+
+LOCAL_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+}}
+SHARED_CACHE = {'default': {
+    'BACKEND': 'django.core.cache.backends.db.DatabaseCache',
+    'LOCATION': 'cache',
+}}
+
+
+class PruneDoneJobsTest(TestCase):
+
+    def test_prunes_only_old_done_jobs(self):
+        old = timezone.now() - timedelta(days=8)
+        fresh = timezone.now() - timedelta(days=1)
+        kept = [
+            Job.objects.create(name='done', status=Job.DONE, run_at=fresh),
+            Job.objects.create(name='failed', status=Job.FAILED, run_at=old),
+            Job.objects.create(name='queued', status=Job.QUEUED, run_at=old),
+        ]
+        Job.objects.create(name='done', status=Job.DONE, run_at=old)
+        self.assertEqual(prune_done_jobs(7), 1)
+        self.assertQuerysetEqual(
+            Job.objects.order_by('pk'), kept, transform=lambda job: job
+        )
+
+
+@background
+def noop():
+    pass
+
+
+class StaleJobsTest(TestCase):
+
+    def setUp(self):
+        self.job = noop.delay()
+        Job.objects.filter(pk=self.job.pk).update(
+            status=Job.RUNNING,
+            updated_at=timezone.now() - timedelta(seconds=STALE_TIMEOUT + 1),
+        )
+
+    def status(self):
+        return Job.objects.get(pk=self.job.pk).status
+
+    def test_worker_runs_stale_jobs(self):
+        call_command('run_worker', '--once', '--threads', '1')
+        self.assertEqual(self.status(), Job.DONE)
+
+    @mock.patch('core.management.commands.run_worker.monotonic')
+    def test_requeued_periodically(self, monotonic):
+        command = RunWorkerCommand()
+        command.maintained_at = monotonic.return_value = 0
+        command.maintain({'keep_days': 7})
+        self.assertEqual(self.status(), Job.RUNNING)
+        monotonic.return_value = MAINTENANCE_INTERVAL
+        command.maintain({'keep_days': 7})
+        self.assertEqual(self.status(), Job.QUEUED)
+
+
+@mock.patch('core.middleware.replica_configured', return_value=True)
+class ReplicaStickinessMiddlewareTest(SimpleTestCase):
+
+    @override_settings(CACHES=SHARED_CACHE)
+    def test_shared_cache(self, replica_configured):
+        ReplicaStickinessMiddleware(lambda request: None)
+
+    @override_settings(CACHES=LOCAL_CACHE)
+    def test_local_cache_fails_at_startup(self, replica_configured):
+        with self.assertRaises(ImproperlyConfigured):
+            ReplicaStickinessMiddleware(lambda request: None)
@@ -1,8 +1,15 @@
-from django.http import FileResponse
+import csv
+import json
+from itertools import groupby
+from operator import itemgetter
+
+from django.db import IntegrityError, transaction
+from django.http import StreamingHttpResponse
 from django.shortcuts import get_object_or_404
 from rest_framework.response import Response
 from rest_framework import status
 
+from recipes.counters import count_subquery
 from recipes.models import Recipe
 
 
@@ -11,27 +18,55 @@ RESPONSE_RECIPE_DELETE_ERROR_MESSAGE = 'Ошибка. Рецепт уже был
 RESPONSE_NOT_AUTHENTICATED_ERROR_MESSAGE = '''
 Незарегистрированый пользователь не может удалять рецепты из корзины.'
 '''
+BULK_CREATED = 'created'
+BULK_EXISTS = 'exists'
+BULK_DELETED = 'deleted'
+BULK_NOT_FOUND = 'not_found'
 
 
-def create_object(request, pk, model_serializer):
+def get_recipes_limit(request):
+    """Возвращает recipes_limit из запроса или None, если он некорректен."""
+    try:
+        recipes_limit = int(request.query_params.get('recipes_limit'))
+    except (TypeError, ValueError):
+        return None
+    return recipes_limit if recipes_limit > 0 else None
+
+
+def create_unique(model, **fields):
+    """Создаёт объект или возвращает None, если он уже существует.
+
+    Вместо проверки exists() перед INSERT дубликат отсекает уникальное
+    ограничение в базе, поэтому двойной клик не приводит к ошибке 500.
+    """
+    try:
+        with transaction.atomic():
+            return model.objects.create(**fields)
+    except IntegrityError:
+        return None
 
-    if not Recipe.objects.filter(id=pk).exists():
+
+@transaction.atomic
+def create_object(request, pk, model_serializer):
+    recipe = Recipe.objects.filter(id=pk).first()
+    if recipe is None:
         return Response(
             {'errors': RESPONSE_RECIPE_DELETE_ERROR_MESSAGE},
             status=status.HTTP_400_BAD_REQUEST
         )
-    serializer = model_serializer(
-        data={
-            'recipe': pk,
-            'user': request.user.id
-        },
-        context={'request': request}
+    instance = create_unique(
+        model_serializer.Meta.model, user=request.user, recipe=recipe
     )
-    serializer.is_valid(raise_exception=True)
-    serializer.save()
+    if instance is None:
+        return Response(
+            {'errors': RESPONSE_RECIPE_POST_ERROR_MESSAGE},
+            status=status.HTTP_400_BAD_REQUEST
+        )
+    serializer = model_serializer(instance, context={'request': request})
     return Response(data=serializer.data, status=status.HTTP_201_CREATED)
 
 
+@transaction.atomic
 def delete_object(model, request, pk):
     user = request.user
     if not user.is_authenticated:
@@ -39,25 +74,148 @@ def delete_object(model, request, pk):
             {'errors': RESPONSE_NOT_AUTHENTICATED_ERROR_MESSAGE},
             status=status.HTTP_400_BAD_REQUEST
         )
-    objects = get_object_or_404(
-        model,
-        user=user,
-        recipe=get_object_or_404(Recipe, pk=pk),
+    deleted, _ = model.objects.filter(user=user, recipe_id=pk).delete()
+    if deleted:
+        return Response(status=status.HTTP_204_NO_CONTENT)
+    get_object_or_404(Recipe, pk=pk)
+    return Response(
+        {'errors': RESPONSE_RECIPE_DELETE_ERROR_MESSAGE},
+        status=status.HTTP_400_BAD_REQUEST
+    )
+
+
+def refresh_recipe_counters(model, counter, recipe_ids):
+    """Пересчитывает счётчик рецептов одним UPDATE после bulk_create.
+
+    bulk_create не вызывает сигналы, поэтому счётчики обновляются здесь.
+    """
+    if not recipe_ids:
+        return
+    Recipe.objects.filter(pk__in=recipe_ids).update(
+        **{counter: count_subquery(model, 'recipe')}
+    )
+
+
+@transaction.atomic
+def bulk_create_objects(request, recipe_ids, model, serializer_class, counter):
+    """Добавляет пользователю рецепты из списка и возвращает итог по каждому.
+
+    Рецепты проверяются одним запросом с IN, новые связи создаются
+    одним INSERT, уже добавленные пропускаются.
+    """
+    user = request.user
+    recipes = Recipe.objects.only(
+        'id', 'name', 'image', 'cooking_time'
+    ).in_bulk(recipe_ids)
+    existing = set(model.objects.filter(
+        user=user, recipe__in=list(recipes)
+    ).order_by().values_list('recipe_id', flat=True))
+    created = [pk for pk in recipes if pk not in existing]
+    model.objects.bulk_create(
+        [model(user=user, recipe_id=pk) for pk in created],
+        ignore_conflicts=True,
+    )
+    refresh_recipe_counters(model, counter, created)
+    results = []
+    for pk in recipe_ids:
+        if pk not in recipes:
+            results.append({'id': pk, 'status': BULK_NOT_FOUND})
+            continue
+        results.append({
+            'id': pk,
+            'status': BULK_EXISTS if pk in existing else BULK_CREATED,
+            'recipe': serializer_class(
+                recipes[pk], context={'request': request}
+            ).data,
+        })
+    return Response(results, status=status.HTTP_200_OK)
+
+
+@transaction.atomic
+def bulk_delete_objects(request, recipe_ids, model):
+    """Удаляет рецепты из списка пользователя и возвращает итог по каждому.
+
+    Строки блокируются до конца транзакции, поэтому одновременное
+    удаление по одному не попадёт в итог дважды. delete() вызывает
+    сигналы, и счётчики рецептов уменьшаются в них.
+    """
+    rows = dict(model.objects.select_for_update().filter(
+        user=request.user, recipe__in=recipe_ids
+    ).values_list('recipe_id', 'pk'))
+    model.objects.filter(pk__in=rows.values()).delete()
+    return Response([
+        {'id': pk, 'status': BULK_DELETED if pk in rows else BULK_NOT_FOUND}
+        for pk in recipe_ids
+    ], status=status.HTTP_200_OK)
+
+
+class Echo:
+    """Буфер для csv.writer, который сразу отдаёт записанную строку."""
+
+    def write(self, value):
+        return value
+
+
+def group_shopping_cart(ingredients):
+    """Суммирует количество по ингредиентам и собирает список рецептов.
+
+    Ожидает строки (название, единица измерения, количество, рецепт),
+    отсортированные по названию и единице измерения.
+    """
+    for (name, measurement_unit), rows in groupby(
+        ingredients, key=itemgetter(0, 1)
+    ):
+        amount = 0
+        recipes = []
+        for *_, row_amount, recipe in rows:
+            amount += row_amount
+            recipes.append(recipe)
+        yield name, measurement_unit, amount, recipes
+
+
+def shopping_cart_txt(items):
+    for name, measurement_unit, amount, recipes in items:
+        yield f'{name}: {amount} {measurement_unit} ({", ".join(recipes)})\n'
+
+
+def shopping_cart_csv(items):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount', 'recipes'))
+    for name, measurement_unit, amount, recipes in items:
+        yield writer.writerow(
+            (name, measurement_unit, amount, ', '.join(recipes))
+        )
+
+
+def shopping_cart_json(items):
+    yield '['
+    separator = ''
+    for name, measurement_unit, amount, recipes in items:
+        yield separator + json.dumps({
+            'name': name,
+            'measurement_unit': measurement_unit,
+            'amount': amount,
+            'recipes': recipes,
+        }, ensure_ascii=False)
+        separator = ',\n'
+    yield ']'
+
+
+SHOPPING_CART_FORMATS = {
+    'txt': (shopping_cart_txt, 'text/plain'),
+    'csv': (shopping_cart_csv, 'text/csv'),
+    'json': (shopping_cart_json, 'application/json'),
+}
+
+
+def stream_shopping_cart(ingredients, file_format='txt'):
+    """Отдаёт список покупок потоком в формате txt, csv или json."""
+    generator, content_type = SHOPPING_CART_FORMATS[file_format]
+    response = StreamingHttpResponse(
+        generator(group_shopping_cart(ingredients)),
+        content_type=f'{content_type}; charset=utf-8'
     )
-    objects.delete()
-    return Response(status=status.HTTP_204_NO_CONTENT)
-
-
-def create_list_of_shopping_cart(ingredients):
-    shopping_list = []
-    for ingredient in ingredients:
-        name = ingredient['ingredient__name']
-        amount = ingredient['ingredient__measurement_unit']
-        measurement_unit = ingredient['total_qty']
-        shopping_list.append(f'{name}: {amount} {measurement_unit}')
-    content = '\n'.join(shopping_list)
-    response = FileResponse(content, content_type='text/plain')
     response['Content-Disposition'] = (
-        'attachment; filename="shopping_cart.txt"'
+        f'attachment; filename="shopping_cart.{file_format}"'
     )
     return response
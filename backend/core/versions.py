@@ -0,0 +1,21 @@
+from uuid import uuid4
+
+from django.core.cache import cache
+
+
+def get_versions(*keys):
+    """Возвращает метки версий из кэша, создавая недостающие.
+
+    Метка — случайная строка, поэтому вытеснение ключа из кэша
+    равносильно смене версии и не приводит к устаревшим данным.
+    """
+    versions = cache.get_many(keys)
+    missing = {key: uuid4().hex for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, timeout=None)
+        versions.update(missing)
+    return versions
+
+
+def bump_versions(*keys):
+    cache.delete_many(keys)
@@ -0,0 +1,5 @@
+def post_worker_init(worker):
+    """Начинает строить индекс продуктов до первого запроса к нему."""
+    from recipes.pantry import start_rebuild
+
+    start_rebuild()
@@ -1,8 +1,10 @@
 from django.contrib import admin
 
 from .models import (
-    Favorite, Ingredient, Recipe, RecipeIngredient, ShoppingCart, Tag
+    Favorite, FeedEntry, Ingredient, Recipe, RecipeIngredient, ShoppingCart,
+    SimilarRecipe, Tag
 )
+from .tasks import refresh_recipe_features
 
 
 class RecipeIngredientInline(admin.TabularInline):
@@ -17,6 +19,12 @@ class FavoriteAdmin(admin.ModelAdmin):
     search_fields = ('user', 'recipe')
 
 
+@admin.register(FeedEntry)
+class FeedEntryAdmin(admin.ModelAdmin):
+    list_display = ('id', 'user', 'recipe', 'pub_date')
+    raw_id_fields = ('user', 'recipe', 'author')
+
+
 @admin.register(Ingredient)
 class IngredientAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'measurement_unit')
@@ -27,11 +35,22 @@ class IngredientAdmin(admin.ModelAdmin):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (RecipeIngredientInline,)
-    list_display = ('id', 'name', 'author', 'text', 'image')
+    list_display = (
+        'id', 'name', 'author', 'text', 'image', 'favorites_count',
+        'in_carts_count'
+    )
     list_display_links = ('name',)
     search_fields = ('name', 'author', 'text', 'ingredients')
     list_filter = ('tags',)
 
+    def save_related(self, request, form, formsets, change):
+        super().save_related(request, form, formsets, change)
+        if change and (
+            'tags' in form.changed_data
+            or any(formset.has_changed() for formset in formsets)
+        ):
+            refresh_recipe_features(form.instance.pk)
+
 
 @admin.register(ShoppingCart)
 class ShoppingCartAdmin(admin.ModelAdmin):
@@ -39,6 +58,12 @@ class ShoppingCartAdmin(admin.ModelAdmin):
     search_fields = ('user', 'recipe')
 
 
+@admin.register(SimilarRecipe)
+class SimilarRecipeAdmin(admin.ModelAdmin):
+    list_display = ('id', 'recipe', 'similar', 'score')
+    raw_id_fields = ('recipe', 'similar')
+
+
 @admin.register(Tag)
 class TagAdmin(admin.ModelAdmin):
     list_display = ('id', 'name', 'color', 'slug')
@@ -0,0 +1,25 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def change_counter(model, pk, field, delta):
+    """Атомарно изменяет счётчик на delta через F-выражение."""
+    model.objects.filter(pk=pk).update(**{field: F(field) + delta})
+
+
+def count_subquery(related_model, field):
+    return Coalesce(Subquery(
+        related_model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)
+
+
+def recount(model, counter, related_model, field):
+    """Исправляет расхождения счётчика, возвращает число исправленных строк."""
+    expected = count_subquery(related_model, field)
+    return model.objects.exclude(**{counter: expected}).update(
+        **{counter: expected}
+    )
@@ -0,0 +1,138 @@
+from django.db.models import Q
+
+from .models import FeedEntry, Recipe
+from users.models import Subscription, User
+
+FAN_OUT_BATCH_SIZE = 1000
+FAN_OUT_FOLLOWERS_LIMIT = 10000
+BACKFILL_SIZE = 100
+
+
+def is_fanned_out(author):
+    """Рецепты популярных авторов не раскладываются по лентам.
+
+    Они подмешиваются при чтении ленты, иначе каждая публикация
+    создавала бы слишком много записей.
+    """
+    return author.followers_count < FAN_OUT_FOLLOWERS_LIMIT
+
+
+def fan_out(recipe):
+    """Добавляет рецепт в ленты подписчиков автора пачками."""
+    if not is_fanned_out(recipe.author):
+        return
+    followers = Subscription.objects.filter(
+        author_id=recipe.author_id
+    ).order_by().values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator(chunk_size=FAN_OUT_BATCH_SIZE):
+        batch.append(FeedEntry(
+            user_id=user_id,
+            recipe_id=recipe.pk,
+            author_id=recipe.author_id,
+            pub_date=recipe.pub_date,
+        ))
+        if len(batch) >= FAN_OUT_BATCH_SIZE:
+            FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def near_fan_out_limit(followers_count):
+    """Могла ли отписка с таким числом подписчиков вернуть автора под порог.
+
+    Сигналы счётчика и ленты идут в произвольном порядке, поэтому
+    число подписчиков может быть прочитано и до, и после уменьшения.
+    """
+    return (
+        FAN_OUT_FOLLOWERS_LIMIT - 1 <= followers_count
+        <= FAN_OUT_FOLLOWERS_LIMIT
+    )
+
+
+def refill(author):
+    """Раскладывает по лентам последние рецепты автора, ставшего обычным.
+
+    Пока у автора было не меньше FAN_OUT_FOLLOWERS_LIMIT подписчиков,
+    его рецепты подмешивались при чтении и не попадали в FeedEntry.
+    Без этого они пропали бы из лент, когда отписка вернула его
+    под порог.
+    """
+    if not is_fanned_out(author):
+        return
+    recipes = list(Recipe.objects.filter(author=author).order_by(
+        '-pub_date', '-id'
+    ).values_list('id', 'pub_date')[:BACKFILL_SIZE])
+    followers = Subscription.objects.filter(
+        author=author
+    ).order_by().values_list('user_id', flat=True)
+    batch = []
+    for user_id in followers.iterator(chunk_size=FAN_OUT_BATCH_SIZE):
+        batch.extend(
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author.pk,
+                pub_date=pub_date,
+            )
+            for recipe_id, pub_date in recipes
+        )
+        if len(batch) >= FAN_OUT_BATCH_SIZE:
+            FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    FeedEntry.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+def backfill(user_id, author):
+    """Добавляет в ленту последние рецепты автора после подписки."""
+    if not is_fanned_out(author):
+        return
+    recipes = Recipe.objects.filter(author=author).order_by(
+        '-pub_date', '-id'
+    ).values_list('id', 'pub_date')[:BACKFILL_SIZE]
+    FeedEntry.objects.bulk_create(
+        [
+            FeedEntry(
+                user_id=user_id,
+                recipe_id=recipe_id,
+                author_id=author.pk,
+                pub_date=pub_date,
+            )
+            for recipe_id, pub_date in recipes
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def trim(user_id, author_id):
+    """Убирает из ленты рецепты автора после отписки."""
+    FeedEntry.objects.filter(user_id=user_id, author_id=author_id).delete()
+
+
+def get_feed_ids(user, position, limit):
+    """Возвращает id рецептов ленты по убыванию (pub_date, id).
+
+    Основная часть читается из FeedEntry одним проходом по индексу
+    (user, pub_date, recipe), рецепты популярных авторов добираются
+    по индексу (author, pub_date) и сливаются с ней.
+    """
+    entries = FeedEntry.objects.filter(user=user)
+    merged = Recipe.objects.filter(author__in=User.objects.filter(
+        subscription__user=user,
+        followers_count__gte=FAN_OUT_FOLLOWERS_LIMIT,
+    ))
+    if position is not None:
+        pub_date, pk = position
+        entries = entries.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, recipe_id__lt=pk)
+        )
+        merged = merged.filter(
+            Q(pub_date__lt=pub_date) | Q(pub_date=pub_date, id__lt=pk)
+        )
+    rows = set(entries.order_by('-pub_date', '-recipe_id').values_list(
+        'pub_date', 'recipe_id'
+    )[:limit])
+    rows.update(merged.order_by('-pub_date', '-id').values_list(
+        'pub_date', 'id'
+    )[:limit])
+    return [pk for _, pk in sorted(rows, reverse=True)[:limit]]
@@ -0,0 +1,89 @@
+import hashlib
+import os
+from io import BytesIO
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage, default_storage
+from django.utils.deconstruct import deconstructible
+from PIL import Image, ImageOps
+
+RENDITIONS_DIR = 'rescipes/renditions/'
+RENDITIONS = {
+    'thumbnail': (320, 320),
+    'medium': (960, 960),
+}
+WEBP = '.webp'
+FORMATS = {
+    '.jpg': 'JPEG',
+    '.jpeg': 'JPEG',
+    '.png': 'PNG',
+    '.gif': 'GIF',
+    WEBP: 'WEBP',
+}
+
+
+@deconstructible
+class ContentAddressedStorage(FileSystemStorage):
+    """Хранилище, которое называет файлы по хэшу их содержимого.
+
+    Повторная загрузка того же изображения не создаёт копию файла,
+    а URL файла никогда не меняет содержимое и кэшируется навсегда.
+    """
+
+    def save(self, name, content, max_length=None):
+        digest = hashlib.sha256()
+        for chunk in content.chunks():
+            digest.update(chunk)
+        directory, filename = os.path.split(name or content.name)
+        extension = os.path.splitext(filename)[1].lower()
+        name = os.path.join(directory, digest.hexdigest() + extension)
+        if self.exists(name):
+            return name
+        return super().save(name, content, max_length)
+
+
+def rendition_name(name, rendition, webp=False):
+    stem, extension = os.path.splitext(os.path.basename(name))
+    if webp or extension.lower() not in FORMATS:
+        extension = WEBP
+    return f'{RENDITIONS_DIR}{stem}_{rendition}{extension.lower()}'
+
+
+def rendition_names(name):
+    """Возвращает имена всех вариантов изображения."""
+    names = {}
+    for rendition in RENDITIONS:
+        names[rendition] = rendition_name(name, rendition)
+        names[f'{rendition}_webp'] = rendition_name(
+            name, rendition, webp=True
+        )
+    return names
+
+
+def render(image, size, image_format):
+    image = image.copy()
+    image.thumbnail(size)
+    if image_format == 'JPEG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    buffer = BytesIO()
+    image.save(buffer, format=image_format, optimize=True)
+    return ContentFile(buffer.getvalue())
+
+
+def build_renditions(name, storage=default_storage):
+    """Создаёт недостающие варианты изображения и возвращает их число."""
+    missing = {
+        key: rendition
+        for key, rendition in rendition_names(name).items()
+        if not storage.exists(rendition)
+    }
+    if not missing:
+        return 0
+    with storage.open(name) as file:
+        image = ImageOps.exif_transpose(Image.open(file))
+        image.load()
+    for key, rendition in missing.items():
+        size = RENDITIONS[key.replace('_webp', '')]
+        image_format = FORMATS[os.path.splitext(rendition)[1]]
+        storage.save(rendition, render(image, size, image_format))
+    return len(missing)
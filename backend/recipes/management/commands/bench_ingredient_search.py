@@ -0,0 +1,50 @@
+import random
+from statistics import mean, quantiles
+from time import perf_counter
+
+from django.core.management import BaseCommand
+
+from api.filters import IngredientFilter
+from recipes.models import Ingredient
+from recipes.search import get_ingredient_index
+
+
+class Command(BaseCommand):
+    help = 'Сравнивает поиск ингредиентов через ORM и через индекс в памяти.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=200)
+        parser.add_argument('--seed', type=int, default=0)
+
+    def measure(self, search, queries):
+        timings = []
+        for query in queries:
+            started = perf_counter()
+            search(query)
+            timings.append((perf_counter() - started) * 1000)
+        return mean(timings), quantiles(timings, n=20)[-1]
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            self.stderr.write('Нет ингредиентов, сначала загрузите их.')
+            return
+        rng = random.Random(options['seed'])
+        queries = [
+            name[:rng.randint(1, 4)]
+            for name in rng.choices(names, k=options['queries'])
+        ]
+        index = get_ingredient_index()
+
+        def orm_search(query):
+            return list(IngredientFilter(
+                {'name': query}, queryset=Ingredient.objects.all()
+            ).qs.values('id', 'name', 'measurement_unit'))
+
+        for label, search in (
+            ('orm', orm_search), ('index', index.search)
+        ):
+            average, p95 = self.measure(search, queries)
+            self.stdout.write(
+                f'{label}: mean {average:.3f} ms, p95 {p95:.3f} ms'
+            )
@@ -0,0 +1,24 @@
+from django.core.management import BaseCommand
+
+from recipes.images import build_renditions
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = 'Создаёт недостающие варианты изображений рецептов.'
+
+    def handle(self, *args, **options):
+        images = Recipe.objects.exclude(image='').order_by().values_list(
+            'image', flat=True
+        ).distinct()
+        created = 0
+        failed = 0
+        for name in images.iterator():
+            try:
+                created += build_renditions(name)
+            except (OSError, ValueError) as error:
+                failed += 1
+                self.stderr.write(f'{name}: {error}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано вариантов: {created}, ошибок: {failed}'
+        ))
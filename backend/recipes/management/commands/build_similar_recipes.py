@@ -0,0 +1,33 @@
+import resource
+from time import perf_counter
+
+from django.core.management import BaseCommand
+
+from recipes.similarity import CHUNK_SIZE, TOP_K, build
+
+
+class Command(BaseCommand):
+    help = (
+        'Пересчитывает похожие рецепты по общим ингредиентам и тегам '
+        'и сообщает время сборки и пиковую память процесса.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+        parser.add_argument('--top-k', type=int, default=TOP_K)
+
+    def progress(self, done, total):
+        if self.verbosity > 1:
+            self.stdout.write(f'{done}/{total}')
+
+    def handle(self, *args, **options):
+        self.verbosity = options['verbosity']
+        started = perf_counter()
+        recipes, saved = build(
+            options['chunk_size'], options['top_k'], self.progress
+        )
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+        self.stdout.write(self.style.SUCCESS(
+            f'Рецептов: {recipes}, похожих: {saved} за '
+            f'{perf_counter() - started:.2f} с, пик памяти {peak:.0f} МБ'
+        ))
@@ -0,0 +1,233 @@
+import random
+from io import BytesIO
+from itertools import accumulate
+from time import perf_counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.files.base import ContentFile
+from django.core.management import BaseCommand, CommandError, call_command
+from django.db import connection, transaction
+from PIL import Image
+
+from api.cache import bump_recipe_versions
+from core.enums import Length
+from recipes.images import build_renditions
+from recipes.management.commands.load_catalog import DATA_DIR
+from recipes.models import (
+    RECIPE_SEARCH_VECTOR, Favorite, Ingredient, Recipe, RecipeIngredient,
+    ShoppingCart, Tag
+)
+from users.models import Subscription, User
+
+DATASET_PASSWORD = 'foodgram-dataset'
+ZIPF_EXPONENT = 1.1
+AMOUNTS = {
+    'г': (10, 256),
+    'мл': (10, 256),
+    'кг': (1, 3),
+}
+DEFAULT_AMOUNT = (1, 5)
+
+
+def zipf_weights(size):
+    """Накопленные веса Ципфа: первые элементы встречаются чаще."""
+    return list(accumulate(
+        1 / (rank + 1) ** ZIPF_EXPONENT for rank in range(size)
+    ))
+
+
+def sample(rng, population, cum_weights, k):
+    """Выбирает до k различных элементов с учётом весов."""
+    k = min(k, len(population))
+    chosen = {}
+    while len(chosen) < k:
+        for item in rng.choices(
+            population, cum_weights=cum_weights, k=k - len(chosen)
+        ):
+            chosen[item] = None
+    return list(chosen)[:k]
+
+
+def placeholder_image(rng):
+    buffer = BytesIO()
+    color = tuple(rng.randrange(256) for _ in range(3))
+    Image.new('RGB', (1200, 800), color).save(buffer, format='JPEG')
+    return ContentFile(buffer.getvalue(), name='dataset.jpg')
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт синтетический набор пользователей, рецептов, подписок, '
+        'избранного и корзин для нагрузочного тестирования.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=100)
+        parser.add_argument('--recipes', type=int, default=1000)
+        parser.add_argument('--scale', type=float, default=1.0)
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--subscriptions', type=int, default=5)
+        parser.add_argument('--favorites', type=int, default=10)
+        parser.add_argument('--carts', type=int, default=3)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument(
+            '--fixture', help='Сохранить данные в фикстуру по этому пути.'
+        )
+
+    def handle(self, *args, **options):
+        self.rng = random.Random(options['seed'])
+        self.batch_size = options['batch_size']
+        self.prefix = f'dataset{options["seed"]}_'
+        users_total = max(1, int(options['users'] * options['scale']))
+        recipes_total = int(options['recipes'] * options['scale'])
+        if User.objects.filter(username__startswith=self.prefix).exists():
+            raise CommandError(
+                f'Набор данных с seed {options["seed"]} уже создан.'
+            )
+        self.load_catalogs()
+        started = perf_counter()
+        with transaction.atomic():
+            user_ids = self.create_users(users_total)
+            recipe_ids = self.create_recipes(user_ids, recipes_total)
+            self.create_relations(
+                Subscription, 'author_id', user_ids, user_ids,
+                options['subscriptions'], exclude_self=True
+            )
+            self.create_relations(
+                Favorite, 'recipe_id', user_ids, recipe_ids,
+                options['favorites']
+            )
+            self.create_relations(
+                ShoppingCart, 'recipe_id', user_ids, recipe_ids,
+                options['carts']
+            )
+            call_command('recount_counters', stdout=self.stdout)
+            call_command('rebuild_feeds', stdout=self.stdout)
+            call_command('build_similar_recipes', stdout=self.stdout)
+            bump_recipe_versions(shared=True)
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано пользователей: {len(user_ids)}, рецептов: '
+            f'{len(recipe_ids)} за {perf_counter() - started:.2f} с. '
+            f'Пароль пользователей: {DATASET_PASSWORD}'
+        ))
+        if options['fixture']:
+            call_command(
+                'dumpdata', 'users.user', 'users.subscription', 'recipes',
+                output=options['fixture'],
+            )
+
+    def load_catalogs(self):
+        if not Ingredient.objects.exists():
+            call_command(
+                'load_catalog', 'ingredients', DATA_DIR / 'ingredients.json',
+                stdout=self.stdout,
+            )
+        if not Tag.objects.exists():
+            call_command('load_catalog', 'tags', stdout=self.stdout)
+
+    def create_users(self, total):
+        password = make_password(DATASET_PASSWORD)
+        User.objects.bulk_create(
+            (
+                User(
+                    username=f'{self.prefix}{number}',
+                    email=f'{self.prefix}{number}@example.com',
+                    first_name=f'Имя{number}',
+                    last_name=f'Фамилия{number}',
+                    password=password,
+                )
+                for number in range(total)
+            ),
+            batch_size=self.batch_size,
+        )
+        return list(User.objects.filter(
+            username__startswith=self.prefix
+        ).order_by('id').values_list('id', flat=True))
+
+    def create_recipes(self, user_ids, total):
+        rng = self.rng
+        ingredients = list(Ingredient.objects.values_list(
+            'id', 'name', 'measurement_unit'
+        ))
+        rng.shuffle(ingredients)
+        ingredient_weights = zipf_weights(len(ingredients))
+        tag_ids = list(Tag.objects.values_list('id', flat=True))
+        author_weights = zipf_weights(len(user_ids))
+        image_field = Recipe._meta.get_field('image')
+        image = image_field.storage.save(
+            image_field.generate_filename(None, 'dataset.jpg'),
+            placeholder_image(rng),
+        )
+        build_renditions(image)
+        recipes = []
+        compositions = []
+        for number in range(total):
+            composition = sample(
+                rng, ingredients, ingredient_weights, rng.randint(3, 12)
+            )
+            compositions.append(composition)
+            names = [name for _, name, _ in composition]
+            recipes.append(Recipe(
+                author_id=rng.choices(user_ids, cum_weights=author_weights)[0],
+                name=f'{names[0].capitalize()} №{number}'[
+                    :Length.MAX_LEN_RECIPES_CHARFIELD.value
+                ],
+                text='Смешать: ' + ', '.join(names) + '.',
+                cooking_time=rng.randint(
+                    5, Length.MAX_COOKING_TIME.value // 8
+                ),
+                image=image,
+            ))
+        Recipe.objects.bulk_create(recipes, batch_size=self.batch_size)
+        recipe_ids = list(Recipe.objects.filter(
+            author__username__startswith=self.prefix
+        ).order_by('id').values_list('id', flat=True))
+        RecipeIngredient.objects.bulk_create(
+            (
+                RecipeIngredient(
+                    recipe_id=recipe_id,
+                    ingredient_id=ingredient_id,
+                    amount=rng.randint(*AMOUNTS.get(unit, DEFAULT_AMOUNT)),
+                )
+                for recipe_id, composition in zip(recipe_ids, compositions)
+                for ingredient_id, _, unit in composition
+            ),
+            batch_size=self.batch_size,
+        )
+        Recipe.tags.through.objects.bulk_create(
+            (
+                Recipe.tags.through(recipe_id=recipe_id, tag_id=tag_id)
+                for recipe_id in recipe_ids
+                for tag_id in rng.sample(
+                    tag_ids, rng.randint(1, min(3, len(tag_ids)))
+                )
+            ),
+            batch_size=self.batch_size,
+        )
+        if connection.vendor == 'postgresql':
+            Recipe.objects.filter(pk__in=recipe_ids).update(
+                search_vector=RECIPE_SEARCH_VECTOR
+            )
+        return recipe_ids
+
+    def create_relations(
+        self, model, field, user_ids, target_ids, average, exclude_self=False
+    ):
+        """Связывает пользователей с популярными по Ципфу объектами."""
+        if not target_ids:
+            return
+        rng = self.rng
+        targets = list(target_ids)
+        rng.shuffle(targets)
+        weights = zipf_weights(len(targets))
+        model.objects.bulk_create(
+            (
+                model(user_id=user_id, **{field: target_id})
+                for user_id in user_ids
+                for target_id in sample(
+                    rng, targets, weights, rng.randint(0, 2 * average)
+                )
+                if not (exclude_self and target_id == user_id)
+            ),
+            batch_size=self.batch_size,
+        )
@@ -0,0 +1,89 @@
+import csv
+import json
+from pathlib import Path
+from time import perf_counter
+
+from django.conf import settings
+from django.core.management import BaseCommand, CommandError
+
+from api.cache import bump_recipe_versions
+from recipes.models import Ingredient, Tag
+from recipes.search import bump_tags_version, bump_version
+
+DATA_DIR = Path(settings.BASE_DIR) / 'recipes' / 'data'
+
+CATALOGS = {
+    'ingredients': {
+        'model': Ingredient,
+        'fields': ('name', 'measurement_unit'),
+        'unique': ('name', 'measurement_unit'),
+        'default_path': DATA_DIR / 'ingredients.csv',
+    },
+    'tags': {
+        'model': Tag,
+        'fields': ('name', 'color', 'slug'),
+        'unique': ('slug',),
+        'default_path': DATA_DIR / 'tags.json',
+    },
+}
+
+
+def read_rows(path, fields):
+    """Построчно читает справочник из CSV или JSON файла."""
+    if path.suffix == '.json':
+        with open(path, encoding='utf-8') as file:
+            for row in json.load(file):
+                yield {field: row[field].strip() for field in fields}
+        return
+    with open(path, encoding='utf-8', newline='') as file:
+        for row in csv.reader(file):
+            if row:
+                yield dict(zip(fields, (value.strip() for value in row)))
+
+
+class Command(BaseCommand):
+    help = 'Загружает справочник ингредиентов или тегов из CSV или JSON.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('catalog', choices=CATALOGS)
+        parser.add_argument('path', nargs='?')
+        parser.add_argument('--batch-size', type=int, default=1000)
+
+    def handle(self, *args, **options):
+        catalog = CATALOGS[options['catalog']]
+        model = catalog['model']
+        path = Path(options['path'] or catalog['default_path'])
+        if path.suffix not in ('.csv', '.json'):
+            raise CommandError(f'Неизвестный формат файла: {path}')
+        if not path.exists():
+            raise CommandError(f'Файл не найден: {path}')
+        batch_size = options['batch_size']
+        started = perf_counter()
+        count_before = model.objects.count()
+        seen = set()
+        batch = []
+        rows = 0
+        for row in read_rows(path, catalog['fields']):
+            rows += 1
+            key = tuple(row[field] for field in catalog['unique'])
+            if key in seen:
+                continue
+            seen.add(key)
+            batch.append(model(**row))
+            if len(batch) >= batch_size:
+                model.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        model.objects.bulk_create(batch, ignore_conflicts=True)
+        # bulk_create не отправляет сигналы, поэтому кэши,
+        # которые сбрасывают обработчики post_save, сбрасываются здесь.
+        if model is Ingredient:
+            bump_version()
+        if model is Tag:
+            bump_tags_version()
+            bump_recipe_versions(shared=True)
+        elapsed = perf_counter() - started
+        created = model.objects.count() - count_before
+        self.stdout.write(self.style.SUCCESS(
+            f'{path.name}: прочитано {rows} строк, добавлено {created} '
+            f'за {elapsed:.2f} с ({rows / elapsed:.0f} строк/с)'
+        ))
@@ -1,23 +1,8 @@
-import csv
-
-from django.core.management import BaseCommand
-from tqdm import tqdm
-
-from recipes.models import (
-    Ingredient
-)
+from django.core.management import BaseCommand, call_command
 
 
 class Command(BaseCommand):
+    help = 'Загружает ингредиенты из recipes/data/ingredients.csv.'
 
     def handle(self, *args, **options):
-
-        with open(
-            'recipes/data/ingredients.csv', 'r', encoding='utf-8'
-        ) as csvfile:
-            reader = csv.reader(csvfile)
-            for row in tqdm(reader):
-                Ingredient.objects.get_or_create(
-                    name=row[0],
-                    measurement_unit=row[1]
-                )
+        call_command('load_catalog', 'ingredients', stdout=self.stdout)
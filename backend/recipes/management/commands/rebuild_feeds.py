@@ -0,0 +1,20 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.feed import backfill
+from recipes.models import FeedEntry
+from users.models import Subscription
+
+
+class Command(BaseCommand):
+    help = 'Заново заполняет ленты подписок по текущим подпискам.'
+
+    def handle(self, *args, **options):
+        subscriptions = Subscription.objects.select_related('author')
+        with transaction.atomic():
+            FeedEntry.objects.all().delete()
+            for subscription in subscriptions.iterator():
+                backfill(subscription.user_id, subscription.author)
+        self.stdout.write(self.style.SUCCESS(
+            f'Записей в лентах: {FeedEntry.objects.count()}'
+        ))
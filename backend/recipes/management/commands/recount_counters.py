@@ -0,0 +1,25 @@
+from django.core.management import BaseCommand
+from django.db import transaction
+
+from recipes.counters import recount
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import Subscription, User
+
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'in_carts_count', ShoppingCart, 'recipe'),
+    (User, 'recipes_count', Recipe, 'author'),
+    (User, 'followers_count', Subscription, 'author'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Пересчитывает счётчики рецептов и пользователей.'
+
+    def handle(self, *args, **options):
+        for model, counter, related_model, field in COUNTERS:
+            with transaction.atomic():
+                fixed = recount(model, counter, related_model, field)
+            self.stdout.write(
+                f'{model.__name__}.{counter}: исправлено {fixed}'
+            )
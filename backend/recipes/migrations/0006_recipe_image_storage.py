@@ -0,0 +1,19 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:17
+
+from django.db import migrations, models
+import recipes.images
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0005_recipe_search_vector'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='recipe',
+            name='image',
+            field=models.ImageField(default=None, storage=recipes.images.ContentAddressedStorage(), upload_to='rescipes/images/'),
+        ),
+    ]
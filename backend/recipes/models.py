@@ -1,9 +1,18 @@
 from colorfield.fields import ColorField
+from django.contrib.postgres.indexes import GinIndex
+from django.contrib.postgres.search import (
+    SearchQuery, SearchRank, SearchVector, SearchVectorField
+)
 from django.core.validators import MaxValueValidator, MinValueValidator
-from django.db import models
+from django.db import connections, models
+from django.db.models import (
+    BooleanField, Case, Exists, F, OuterRef, Q, Subquery, Value, When
+)
 
+from .images import ContentAddressedStorage
 from core.enums import Length
-from users.models import User
+from core.models import ChangedFieldsMixin
+from users.models import Subscription, User
 
 
 class Tag(models.Model):
@@ -57,7 +66,73 @@ class Ingredient(models.Model):
         return self.name
 
 
-class Recipe(models.Model):
+SEARCH_CONFIG = 'russian'
+RECIPE_SEARCH_VECTOR = (
+    SearchVector('name', weight='A', config=SEARCH_CONFIG)
+    + SearchVector('text', weight='B', config=SEARCH_CONFIG)
+)
+
+
+class RecipeQuerySet(models.QuerySet):
+
+    def with_user_flags(self, user):
+        """Аннотирует рецепты флагами избранного, корзины и подписки."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_favorited=Value(False, output_field=BooleanField()),
+                is_in_shopping_cart=Value(False, output_field=BooleanField()),
+                author_is_subscribed=Value(False, output_field=BooleanField()),
+            )
+        return self.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            is_in_shopping_cart=Exists(ShoppingCart.objects.filter(
+                user=user, recipe=OuterRef('pk')
+            )),
+            author_is_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('author')
+            )),
+        )
+
+    def search(self, text):
+        """Полнотекстовый поиск по названию и описанию с ранжированием.
+
+        На PostgreSQL использует сохранённый search_vector и GIN-индекс,
+        на других СУБД сводится к icontains с тем же порядком выдачи.
+        """
+        if connections[self.db].vendor == 'postgresql':
+            query = SearchQuery(
+                text, config=SEARCH_CONFIG, search_type='websearch'
+            )
+            return self.filter(search_vector=query).annotate(
+                rank=SearchRank(F('search_vector'), query)
+            ).order_by('-rank', '-pub_date')
+        return self.filter(
+            Q(name__icontains=text) | Q(text__icontains=text)
+        ).annotate(
+            rank=Case(
+                When(name__icontains=text, then=Value(1.0)),
+                default=Value(0.4),
+            )
+        ).order_by('-rank', '-pub_date')
+
+    def latest_per_author(self, limit):
+        """Оставляет не больше limit последних рецептов каждого автора."""
+        return self.filter(pk__in=Subquery(
+            Recipe.objects.filter(
+                author=OuterRef('author')
+            ).values('pk')[:limit]
+        ))
+
+
+class RecipeManager(models.Manager.from_queryset(RecipeQuerySet)):
+
+    def get_queryset(self):
+        return super().get_queryset().defer('search_vector')
+
+
+class Recipe(ChangedFieldsMixin, models.Model):
 
     name = models.CharField(
         verbose_name='Рецепт',
@@ -79,6 +154,7 @@ class Recipe(models.Model):
     )
     image = models.ImageField(
         upload_to='rescipes/images/',
+        storage=ContentAddressedStorage(),
         default=None,
     )
     ingredients = models.ManyToManyField(
@@ -98,12 +174,39 @@ class Recipe(models.Model):
         auto_now_add=True,
         editable=False,
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='В избранном',
+        default=0,
+        editable=False,
+    )
+    in_carts_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок',
+        default=0,
+        editable=False,
+    )
+    search_vector = SearchVectorField(
+        null=True,
+        editable=False,
+    )
+
+    objects = RecipeManager()
 
     class Meta:
         default_related_name = 'recipes'
         verbose_name = 'Рецепт'
         verbose_name_plural = 'Рецепты'
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(
+                fields=('pub_date', 'id'),
+                name='recipe_pub_date_id_idx'),
+            models.Index(
+                fields=('author', 'pub_date'),
+                name='recipe_author_pub_date_idx'),
+            GinIndex(
+                fields=('search_vector',),
+                name='recipe_search_vector_idx'),
+        ]
 
     def __str__(self):
         return self.name
@@ -173,6 +276,10 @@ class Favorite(models.Model):
             fields=('recipe', 'user'),
             name='unique_recipe')
         ]
+        indexes = [models.Index(
+            fields=('user', 'recipe'),
+            name='favorite_user_recipe_idx')
+        ]
 
     def __str__(self):
         return f'{self.user} - {self.recipe}'
@@ -202,6 +309,88 @@ class ShoppingCart(models.Model):
             fields=('recipe', 'user'),
             name='unique_shopping_cart')
         ]
+        indexes = [models.Index(
+            fields=('user', 'recipe'),
+            name='shopping_cart_user_recipe_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.user} - {self.recipe}'
+
+
+class FeedEntry(models.Model):
+    """Запись ленты подписок: рецепт автора, на которого подписан user."""
+
+    user = models.ForeignKey(
+        User,
+        verbose_name='Читатель ленты',
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+    )
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='feed_entries',
+    )
+    author = models.ForeignKey(
+        User,
+        verbose_name='Автор рецепта',
+        on_delete=models.CASCADE,
+        related_name='+',
+    )
+    pub_date = models.DateTimeField(
+        verbose_name='Дата публикации рецепта',
+    )
+
+    class Meta:
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Лента подписок'
+        ordering = ('-pub_date',)
+        constraints = [models.UniqueConstraint(
+            fields=('user', 'recipe'),
+            name='unique_feed_entry')
+        ]
+        indexes = [models.Index(
+            fields=('user', 'pub_date', 'recipe'),
+            name='feed_user_pub_date_idx')
+        ]
 
     def __str__(self):
         return f'{self.user} - {self.recipe}'
+
+
+class SimilarRecipe(models.Model):
+    """Один из ближайших соседей рецепта по ингредиентам и тегам."""
+
+    recipe = models.ForeignKey(
+        Recipe,
+        verbose_name='Рецепт',
+        on_delete=models.CASCADE,
+        related_name='similar_entries',
+    )
+    similar = models.ForeignKey(
+        Recipe,
+        verbose_name='Похожий рецепт',
+        on_delete=models.CASCADE,
+        related_name='similar_to',
+    )
+    score = models.FloatField(
+        verbose_name='Сходство',
+    )
+
+    class Meta:
+        verbose_name = 'Похожий рецепт'
+        verbose_name_plural = 'Похожие рецепты'
+        ordering = ('recipe', '-score')
+        constraints = [models.UniqueConstraint(
+            fields=('recipe', 'similar'),
+            name='unique_similar_recipe')
+        ]
+        indexes = [models.Index(
+            fields=('recipe', '-score'),
+            name='similar_recipe_score_idx')
+        ]
+
+    def __str__(self):
+        return f'{self.recipe} - {self.similar}'
@@ -0,0 +1,321 @@
+import logging
+import re
+from array import array
+from bisect import bisect_left, insort
+from collections import defaultdict
+from threading import Lock, Thread
+
+from django.core.cache import cache
+from django.db import connection
+
+from .similarity import load_features
+
+logger = logging.getLogger('foodgram.pantry')
+
+SEQUENCE_KEY = 'pantry:sequence'
+CHANGE_KEY = 'pantry:change:{}'
+CHANGE_TIMEOUT = 24 * 60 * 60
+MAX_PATCH_SIZE = 500
+DENSE_SHARE = 256
+
+NONZERO = re.compile(rb'[^\x00]')
+BYTE_BITS = [
+    tuple(bit for bit in range(7, -1, -1) if byte >> bit & 1)
+    for byte in range(256)
+]
+
+_index = None
+_lock = Lock()
+_rebuilding = False
+
+
+def to_mask(recipe_ids):
+    """Битовая маска из отсортированных id рецептов."""
+    if not recipe_ids:
+        return 0
+    data = bytearray(recipe_ids[-1] // 8 + 1)
+    for recipe_id in recipe_ids:
+        data[recipe_id >> 3] |= 1 << (recipe_id & 7)
+    return int.from_bytes(data, 'little')
+
+
+def iter_bits(mask):
+    """Номера единичных битов маски по убыванию."""
+    data = mask.to_bytes((mask.bit_length() + 7) // 8, 'big')
+    last = len(data) - 1
+    for match in NONZERO.finditer(data):
+        base = (last - match.start()) * 8
+        for bit in BYTE_BITS[data[match.start()]]:
+            yield base + bit
+
+
+class PantryIndex:
+    """Обратный индекс признак -> рецепты в памяти процесса.
+
+    Признаки те же, что у похожих рецептов: id ингредиента или id тега
+    со знаком минус. Для каждого признака хранится отсортированный
+    массив id рецептов, для признаков не реже чем у каждого DENSE_SHARE
+    рецепта ещё и битовая маска, где бит с номером id рецепта означает,
+    что признак у рецепта есть.
+    Число совпавших ингредиентов и число ингредиентов рецепта хранятся
+    по разрядам в масках-плоскостях, поэтому поиск сводится к десяткам
+    побитовых операций над длинными целыми независимо от того,
+    в скольких рецептах встречается соль.
+    """
+
+    def __init__(self, features, sequence=0):
+        self.sequence = sequence
+        self.postings = defaultdict(lambda: array('I'))
+        sizes = defaultdict(list)
+        for recipe_id in sorted(features):
+            size = 0
+            for feature in features[recipe_id]:
+                self.postings[feature].append(recipe_id)
+                size += feature > 0
+            sizes[size].append(recipe_id)
+        self.universe = to_mask(sorted(features))
+        self.masks = {
+            feature: to_mask(recipe_ids)
+            for feature, recipe_ids in self.postings.items()
+            if len(recipe_ids) * DENSE_SHARE >= len(features)
+        }
+        self.sizes = [0] * max(sizes, default=0).bit_length()
+        for size, recipe_ids in sizes.items():
+            mask = to_mask(recipe_ids)
+            for bit in range(size.bit_length()):
+                if size >> bit & 1:
+                    self.sizes[bit] |= mask
+
+    def mask(self, feature):
+        if feature in self.masks:
+            return self.masks[feature]
+        return to_mask(self.postings.get(feature))
+
+    def remove(self, recipe_id):
+        bit = 1 << recipe_id
+        size = 0
+        for feature, recipe_ids in self.postings.items():
+            position = bisect_left(recipe_ids, recipe_id)
+            if position == len(recipe_ids):
+                continue
+            if recipe_ids[position] != recipe_id:
+                continue
+            del recipe_ids[position]
+            size += feature > 0
+            if feature in self.masks:
+                self.masks[feature] ^= bit
+        if self.universe >> recipe_id & 1:
+            self.universe ^= bit
+            for plane in range(size.bit_length()):
+                if size >> plane & 1:
+                    self.sizes[plane] ^= bit
+
+    def add(self, recipe_id, features):
+        bit = 1 << recipe_id
+        size = 0
+        for feature in features:
+            insort(self.postings[feature], recipe_id)
+            size += feature > 0
+            if feature in self.masks:
+                self.masks[feature] |= bit
+        self.universe |= bit
+        self.sizes.extend([0] * (size.bit_length() - len(self.sizes)))
+        for plane in range(size.bit_length()):
+            if size >> plane & 1:
+                self.sizes[plane] |= bit
+
+    def update(self, recipe_ids, sequence):
+        """Переносит в индекс изменения рецептов из журнала."""
+        features = load_features(recipe_ids)
+        for recipe_id in recipe_ids:
+            self.remove(recipe_id)
+            if recipe_id in features:
+                self.add(recipe_id, features[recipe_id])
+        self.sequence = sequence
+
+    def count(self, ingredient_ids):
+        """Маски-плоскости числа совпавших ингредиентов каждого рецепта.
+
+        Маски ингредиентов складываются столбиком: плоскость i
+        содержит i-й двоичный разряд суммы.
+        """
+        planes = []
+        for ingredient_id in ingredient_ids:
+            carry = self.mask(ingredient_id)
+            for plane, bits in enumerate(planes):
+                if not carry:
+                    break
+                planes[plane], carry = bits ^ carry, bits & carry
+            if carry:
+                planes.append(carry)
+        return planes
+
+    def equals(self, planes, value):
+        mask = self.universe
+        for plane, bits in enumerate(planes):
+            mask &= bits if value >> plane & 1 else bits ^ self.universe
+        return mask if value < 1 << len(planes) else 0
+
+    def covered(self, planes, missing):
+        """Рецепты, которым не хватает не больше missing ингредиентов.
+
+        Это рецепты, у которых число совпавших ингредиентов плюс
+        missing не меньше числа всех их ингредиентов.
+        """
+        planes = list(planes)
+        for plane in range(missing.bit_length()):
+            if not missing >> plane & 1:
+                continue
+            carry = self.universe
+            for position in range(plane, len(planes)):
+                if not carry:
+                    break
+                bits = planes[position]
+                planes[position], carry = bits ^ carry, bits & carry
+            if carry:
+                planes.extend([0] * (plane - len(planes)))
+                planes.append(carry)
+        greater, equal = 0, self.universe
+        for plane in reversed(range(max(len(planes), len(self.sizes)))):
+            have = planes[plane] if plane < len(planes) else 0
+            need = self.sizes[plane] if plane < len(self.sizes) else 0
+            greater |= equal & have & (need ^ self.universe)
+            equal &= have ^ need ^ self.universe
+        return greater | equal
+
+    def search(self, ingredient_ids, missing=None, tag_ids=(), offset=0,
+               limit=None):
+        """Возвращает id рецептов по убыванию числа совпавших ингредиентов.
+
+        Рецепты с равным числом совпадений идут от новых к старым.
+        Рецепт попадает в выдачу, если в нём есть хотя бы один из
+        ингредиентов, хотя бы один из тегов tag_ids, если они заданы,
+        и если ему не хватает не больше missing ингредиентов.
+        """
+        ingredient_ids = set(ingredient_ids)
+        planes = self.count(ingredient_ids)
+        candidates = 0
+        for bits in planes:
+            candidates |= bits
+        if tag_ids:
+            tagged = 0
+            for tag_id in set(tag_ids):
+                tagged |= self.mask(-tag_id)
+            candidates &= tagged
+        if missing is not None:
+            candidates &= self.covered(planes, missing)
+        result = []
+        for matched in range(len(ingredient_ids), 0, -1):
+            if not candidates:
+                break
+            group = candidates & self.equals(planes, matched)
+            if not group:
+                continue
+            candidates ^= group
+            for recipe_id in iter_bits(group):
+                if offset:
+                    offset -= 1
+                    continue
+                result.append(recipe_id)
+                if len(result) == limit:
+                    return result
+        return result
+
+
+class PantryIndexNotReady(Exception):
+    """В процессе ещё нет индекса: первая сборка идёт в фоне."""
+
+
+def next_sequence():
+    """Следующий номер журнала изменений.
+
+    Ключ номера заводится заново с нуля, если его вытеснили из кэша,
+    в том числе между add и incr.
+    """
+    while True:
+        cache.add(SEQUENCE_KEY, 0, timeout=None)
+        try:
+            return cache.incr(SEQUENCE_KEY)
+        except ValueError:
+            continue
+
+
+def record_change(recipe_id):
+    """Записывает изменение рецепта в журнал для индексов процессов.
+
+    После сброса номера журнала номера, записи которых ещё лежат
+    в кэше, пропускаются, чтобы не затереть чужие изменения.
+    """
+    while not cache.add(
+        CHANGE_KEY.format(next_sequence()), recipe_id, CHANGE_TIMEOUT
+    ):
+        pass
+
+
+def rebuild():
+    """Строит индекс по базе и подменяет им индекс процесса.
+
+    Номер журнала читается до загрузки признаков, поэтому изменения,
+    записанные во время сборки, потом дочитываются ещё раз.
+    """
+    global _index
+    index = PantryIndex(load_features(), cache.get(SEQUENCE_KEY, 0))
+    with _lock:
+        _index = index
+    return index
+
+
+def rebuild_in_background():
+    global _rebuilding
+    try:
+        rebuild()
+    except Exception:
+        logger.exception('Не удалось построить индекс продуктов.')
+    finally:
+        connection.close()
+        with _lock:
+            _rebuilding = False
+
+
+def start_rebuild():
+    """Запускает сборку индекса в фоновом потоке, если она ещё не идёт."""
+    global _rebuilding
+    with _lock:
+        if _rebuilding:
+            return
+        _rebuilding = True
+    Thread(
+        target=rebuild_in_background, name='pantry-index', daemon=True
+    ).start()
+
+
+def get_pantry_index():
+    """Возвращает индекс, дочитывая в него журнал изменений рецептов.
+
+    Если журнал отстал больше чем на MAX_PATCH_SIZE записей, его часть
+    вытеснена из кэша или номер сброшен, индекс перестраивается
+    в фоновом потоке, а до конца сборки отдаётся прежний. Пока
+    у процесса нет ни одного индекса, поднимается PantryIndexNotReady.
+    """
+    index = _index
+    if index is None:
+        start_rebuild()
+        raise PantryIndexNotReady
+    sequence = cache.get(SEQUENCE_KEY, 0)
+    if sequence == index.sequence:
+        return index
+    with _lock:
+        if 0 < sequence - index.sequence <= MAX_PATCH_SIZE:
+            keys = [
+                CHANGE_KEY.format(number)
+                for number in range(index.sequence + 1, sequence + 1)
+            ]
+            changes = cache.get_many(keys)
+            if len(changes) == len(keys):
+                index.update(sorted(set(changes.values())), sequence)
+                return index
+        elif sequence == index.sequence:
+            # Другой поток уже дочитал журнал до этого номера.
+            return index
+    start_rebuild()
+    return index
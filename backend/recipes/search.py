@@ -0,0 +1,76 @@
+from bisect import bisect_left
+
+from .models import Ingredient, Tag
+from core.versions import bump_versions, get_versions
+
+INGREDIENTS_VERSION_KEY = 'ingredients:version'
+TAGS_VERSION_KEY = 'tags:version'
+SEARCH_LIMIT = 50
+
+_index = None
+_tags = None
+
+
+class IngredientIndex:
+    """Поисковый индекс ингредиентов в памяти процесса.
+
+    Хранит ингредиенты отсортированными по приведённому к нижнему
+    регистру названию: совпадения по началу строки находятся бинарным
+    поиском, совпадения по подстроке добираются линейным проходом.
+    """
+
+    def __init__(self, ingredients, version=None):
+        rows = sorted(
+            ingredients, key=lambda row: (row['name'].casefold(), row['id'])
+        )
+        self.rows = rows
+        self.keys = [row['name'].casefold() for row in rows]
+        self.version = version
+
+    def search(self, query, limit=SEARCH_LIMIT):
+        query = query.casefold()
+        if not query:
+            return self.rows[:limit]
+        start = bisect_left(self.keys, query)
+        end = start
+        while end < len(self.keys) and self.keys[end].startswith(query):
+            end += 1
+        result = self.rows[start:min(end, start + limit)]
+        if len(result) < limit:
+            for position, key in enumerate(self.keys):
+                if start <= position < end or query not in key:
+                    continue
+                result.append(self.rows[position])
+                if len(result) == limit:
+                    break
+        return result
+
+
+def bump_version():
+    """Помечает индексы во всех процессах как устаревшие."""
+    bump_versions(INGREDIENTS_VERSION_KEY)
+
+
+def get_ingredient_index():
+    """Возвращает индекс, перестраивая его при смене версии в кэше."""
+    global _index
+    version = get_versions(INGREDIENTS_VERSION_KEY)[INGREDIENTS_VERSION_KEY]
+    if _index is None or _index.version != version:
+        _index = IngredientIndex(
+            Ingredient.objects.values('id', 'name', 'measurement_unit'),
+            version=version,
+        )
+    return _index
+
+
+def bump_tags_version():
+    bump_versions(TAGS_VERSION_KEY)
+
+
+def get_tag_ids():
+    """Возвращает словарь слаг -> id тегов, обновляя его при смене версии."""
+    global _tags
+    version = get_versions(TAGS_VERSION_KEY)[TAGS_VERSION_KEY]
+    if _tags is None or _tags[0] != version:
+        _tags = version, dict(Tag.objects.values_list('slug', 'id'))
+    return _tags[1]
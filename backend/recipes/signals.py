@@ -0,0 +1,138 @@
+from functools import partial
+
+from django.db import connections, transaction
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .counters import change_counter
+from .feed import backfill, near_fan_out_limit, trim
+from .models import (
+    RECIPE_SEARCH_VECTOR, Favorite, Ingredient, Recipe, RecipeIngredient,
+    ShoppingCart, Tag
+)
+from .pantry import record_change
+from .search import bump_tags_version, bump_version
+from .tasks import (
+    build_recipe_renditions, fan_out_recipe, refill_feeds,
+    refresh_recipe_features
+)
+from api.cache import bump_recipe_versions
+from users.models import Subscription, User
+
+SEARCH_FIELDS = {'name', 'text'}
+RECIPE_COUNTERS = {
+    Favorite: 'favorites_count',
+    ShoppingCart: 'in_carts_count',
+}
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def invalidate_ingredient_index(**kwargs):
+    bump_version()
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_tag_ids(**kwargs):
+    bump_tags_version()
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+@receiver((post_save, post_delete), sender=Tag)
+def invalidate_all_recipes(**kwargs):
+    bump_recipe_versions(shared=True)
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def invalidate_recipe(instance, **kwargs):
+    bump_recipe_versions(instance.pk)
+
+
+@receiver((post_save, post_delete), sender=RecipeIngredient)
+def invalidate_related_recipe(instance, **kwargs):
+    bump_recipe_versions(instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def invalidate_recipe_tags(instance, action, reverse, **kwargs):
+    if not action.startswith('post_'):
+        return
+    if reverse:
+        bump_recipe_versions(shared=True)
+    else:
+        bump_recipe_versions(instance.pk)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+def increment_recipe_counter(sender, instance, created, **kwargs):
+    if created:
+        change_counter(Recipe, instance.recipe_id, RECIPE_COUNTERS[sender], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShoppingCart)
+def decrement_recipe_counter(sender, instance, **kwargs):
+    change_counter(Recipe, instance.recipe_id, RECIPE_COUNTERS[sender], -1)
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(instance, **kwargs):
+    change_counter(User, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(post_save, sender=Recipe)
+def update_search_vector(instance, using, update_fields, **kwargs):
+    if connections[using].vendor != 'postgresql':
+        return
+    if update_fields and not SEARCH_FIELDS & set(update_fields):
+        return
+    Recipe.objects.using(using).filter(pk=instance.pk).update(
+        search_vector=RECIPE_SEARCH_VECTOR
+    )
+
+
+@receiver(post_save, sender=Recipe)
+def create_image_renditions(instance, created, **kwargs):
+    if not created and not instance.changed_fields({'image'}):
+        return
+    if instance.image:
+        build_recipe_renditions.delay(instance.image.name)
+
+
+@receiver(post_save, sender=Recipe)
+def publish_to_feeds(instance, created, **kwargs):
+    if created:
+        fan_out_recipe.delay(instance.pk)
+
+
+@receiver(post_save, sender=Recipe)
+def update_recipe_features(instance, created, **kwargs):
+    if created:
+        refresh_recipe_features(instance.pk)
+
+
+@receiver(post_delete, sender=Recipe)
+def update_pantry_index(instance, **kwargs):
+    transaction.on_commit(partial(record_change, instance.pk))
+
+
+@receiver(post_save, sender=Subscription)
+def backfill_feed(instance, created, **kwargs):
+    if created:
+        backfill(instance.user_id, instance.author)
+
+
+@receiver(post_delete, sender=Subscription)
+def trim_feed(instance, **kwargs):
+    trim(instance.user_id, instance.author_id)
+    followers_count = User.objects.filter(
+        pk=instance.author_id
+    ).values_list('followers_count', flat=True).first()
+    if followers_count is not None and near_fan_out_limit(followers_count):
+        refill_feeds.delay(instance.author_id)
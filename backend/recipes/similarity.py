@@ -0,0 +1,255 @@
+import heapq
+from array import array
+from collections import Counter, defaultdict
+from itertools import compress
+from math import log, sqrt
+from operator import truediv
+
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Q, Subquery
+
+from .models import Recipe, RecipeIngredient, SimilarRecipe
+
+TOP_K = 10
+CHUNK_SIZE = 1000
+CANDIDATES_FACTOR = 5
+COMMON_FEATURE_FREQUENCY = 1000
+FREQUENCIES_KEY = 'similar:frequencies'
+
+
+class Weights:
+    """IDF-веса признаков рецептов.
+
+    Признак — id ингредиента или id тега со знаком минус. Вектор
+    рецепта состоит из весов его признаков, сходство рецептов —
+    косинус между векторами.
+    """
+
+    def __init__(self, total, frequencies):
+        self.total = total
+        self.frequencies = frequencies
+        default = log(1 + total) ** 2
+        self.squares = defaultdict(lambda: default, (
+            (feature, log(1 + total / frequency) ** 2)
+            for feature, frequency in frequencies.items()
+        ))
+
+    def square(self, feature):
+        return self.squares[feature]
+
+    def norm(self, features):
+        return sqrt(sum(map(self.squares.__getitem__, features)))
+
+    def rare(self, features):
+        """Признаки, по которым ищутся кандидаты в соседи.
+
+        Частые признаки вроде соли или тега «Завтрак» почти ничего
+        не добавляют к сходству, но их списки рецептов самые длинные.
+        Без них время сборки растёт линейно с числом рецептов. Если
+        редких признаков нет, берётся самый редкий из имеющихся.
+        """
+        rare = [
+            feature for feature in features
+            if self.frequencies.get(feature, 0) <= COMMON_FEATURE_FREQUENCY
+        ]
+        return rare or [min(
+            features, key=lambda feature: self.frequencies.get(feature, 0)
+        )]
+
+
+def load_features(recipe_ids=None):
+    """Возвращает словарь id рецепта -> список его признаков."""
+    ingredients = RecipeIngredient.objects.order_by()
+    tags = Recipe.tags.through.objects.order_by()
+    if recipe_ids is not None:
+        ingredients = ingredients.filter(recipe_id__in=recipe_ids)
+        tags = tags.filter(recipe_id__in=recipe_ids)
+    features = defaultdict(list)
+    for recipe_id, ingredient_id in ingredients.values_list(
+        'recipe_id', 'ingredient_id'
+    ).iterator(chunk_size=CHUNK_SIZE * 10):
+        features[recipe_id].append(ingredient_id)
+    for recipe_id, tag_id in tags.values_list(
+        'recipe_id', 'tag_id'
+    ).iterator(chunk_size=CHUNK_SIZE * 10):
+        features[recipe_id].append(-tag_id)
+    return features
+
+
+def count_frequencies():
+    frequencies = dict(RecipeIngredient.objects.order_by().values_list(
+        'ingredient_id'
+    ).annotate(Count('id')))
+    frequencies.update(
+        (-tag_id, frequency)
+        for tag_id, frequency in Recipe.tags.through.objects.order_by(
+        ).values_list('tag_id').annotate(Count('id'))
+    )
+    return Recipe.objects.count(), frequencies
+
+
+def get_weights():
+    """Веса из последней полной сборки, при их отсутствии — по базе.
+
+    Частоты признаков меняются медленно, поэтому между полными
+    сборками для обновления отдельных рецептов хватает сохранённых.
+    """
+    cached = cache.get(FREQUENCIES_KEY)
+    if cached is None:
+        cached = count_frequencies()
+        cache.set(FREQUENCIES_KEY, cached, timeout=None)
+    return Weights(*cached)
+
+
+def cosine(query, norm, features, features_norm, weights):
+    dot = sum(map(weights.squares.__getitem__, query.intersection(features)))
+    return dot / (norm * features_norm)
+
+
+def nearest(features, scores, vectors, norms, weights, top_k):
+    """Отбирает top_k соседей среди кандидатов с лучшим частичным счётом.
+
+    scores — сумма квадратов весов общих редких признаков. Точный
+    косинус считается только для top_k * CANDIDATES_FACTOR кандидатов
+    с наибольшим отношением счёта к норме вектора.
+    """
+    query = set(features)
+    norm = weights.norm(features)
+    candidates = scores
+    ratios = list(map(
+        truediv, scores.values(), map(norms.__getitem__, scores)
+    ))
+    if len(ratios) > top_k * CANDIDATES_FACTOR:
+        threshold = sorted(ratios)[-top_k * CANDIDATES_FACTOR]
+        candidates = compress(scores, map(threshold.__le__, ratios))
+    return heapq.nlargest(top_k, (
+        (cosine(query, norm, vectors[other], norms[other], weights), other)
+        for other in candidates
+    ))
+
+
+def build(chunk_size=CHUNK_SIZE, top_k=TOP_K, progress=None):
+    """Пересчитывает соседей всех рецептов.
+
+    В памяти держатся только признаки рецептов и обратный индекс
+    признак -> рецепты, размер которых линеен числу строк
+    RecipeIngredient. Соседи считаются и записываются порциями
+    по chunk_size рецептов, каждая в своей транзакции.
+    """
+    vectors = load_features()
+    frequencies = Counter(
+        feature for features in vectors.values() for feature in features
+    )
+    cache.set(FREQUENCIES_KEY, (len(vectors), frequencies), timeout=None)
+    weights = Weights(len(vectors), frequencies)
+    recipe_ids = sorted(vectors)
+    postings = defaultdict(lambda: array('q'))
+    for recipe_id in recipe_ids:
+        for feature in vectors[recipe_id]:
+            postings[feature].append(recipe_id)
+    norms = {
+        recipe_id: weights.norm(features)
+        for recipe_id, features in vectors.items()
+    }
+    saved = 0
+    for start in range(0, len(recipe_ids), chunk_size):
+        chunk = recipe_ids[start:start + chunk_size]
+        rows = []
+        for recipe_id in chunk:
+            features = vectors[recipe_id]
+            scores = defaultdict(float)
+            for feature in weights.rare(features):
+                square = weights.square(feature)
+                for other in postings[feature]:
+                    scores[other] += square
+            del scores[recipe_id]
+            rows.extend(
+                SimilarRecipe(
+                    recipe_id=recipe_id, similar_id=other, score=score
+                )
+                for score, other in nearest(
+                    features, scores, vectors, norms, weights, top_k
+                )
+            )
+        with transaction.atomic():
+            SimilarRecipe.objects.filter(recipe_id__in=chunk).delete()
+            SimilarRecipe.objects.bulk_create(rows, ignore_conflicts=True)
+        saved += len(rows)
+        if progress is not None:
+            progress(start + len(chunk), len(recipe_ids))
+    return len(recipe_ids), saved
+
+
+def refresh(recipe_id, top_k=TOP_K):
+    """Пересчитывает соседей одного рецепта после его изменения.
+
+    Рецепт добавляется в списки своих новых соседей, а в списках,
+    где он уже был, получает новый счёт. Из списков рецептов, которым
+    он стал ближе, чем их нынешние соседи, но которые не попали в его
+    собственный список, его добавит следующая полная сборка.
+
+    Обновления одного рецепта идут по очереди под блокировкой его
+    строки. Обновления разных рецептов могут одновременно записать
+    одну и ту же пару, и тогда остаётся счёт того, кто успел первым.
+    """
+    weights = get_weights()
+    with transaction.atomic():
+        if not Recipe.objects.select_for_update().filter(
+            pk=recipe_id
+        ).values_list('pk', flat=True):
+            return
+        features = load_features([recipe_id]).get(recipe_id)
+        referrers = list(SimilarRecipe.objects.filter(
+            similar_id=recipe_id
+        ).values_list('recipe_id', flat=True))
+        SimilarRecipe.objects.filter(
+            Q(recipe_id=recipe_id) | Q(similar_id=recipe_id)
+        ).delete()
+        if not features:
+            return
+        rare = weights.rare(features)
+        scores = defaultdict(float)
+        for other, ingredient_id in RecipeIngredient.objects.filter(
+            ingredient_id__in=[feature for feature in rare if feature > 0]
+        ).exclude(recipe_id=recipe_id).values_list(
+            'recipe_id', 'ingredient_id'
+        ):
+            scores[other] += weights.square(ingredient_id)
+        for other, tag_id in Recipe.tags.through.objects.filter(
+            tag_id__in=[-feature for feature in rare if feature < 0]
+        ).exclude(recipe_id=recipe_id).values_list('recipe_id', 'tag_id'):
+            scores[other] += weights.square(-tag_id)
+        vectors = load_features(set(scores).union(referrers))
+        norms = {
+            other: weights.norm(other_features)
+            for other, other_features in vectors.items()
+        }
+        neighbours = nearest(features, scores, vectors, norms, weights, top_k)
+        reverse = {other: score for score, other in neighbours}
+        query = set(features)
+        norm = weights.norm(features)
+        for other in referrers:
+            if other in vectors and other not in reverse:
+                reverse[other] = cosine(
+                    query, norm, vectors[other], norms[other], weights
+                )
+        SimilarRecipe.objects.bulk_create(
+            [
+                SimilarRecipe(
+                    recipe_id=recipe_id, similar_id=other, score=score
+                )
+                for score, other in neighbours
+            ] + [
+                SimilarRecipe(
+                    recipe_id=other, similar_id=recipe_id, score=score
+                )
+                for other, score in reverse.items() if score > 0
+            ],
+            ignore_conflicts=True,
+        )
+        for other in set(reverse).difference(referrers):
+            entries = SimilarRecipe.objects.filter(recipe_id=other)
+            entries.exclude(pk__in=Subquery(
+                entries.order_by('-score').values('pk')[:top_k]
+            )).delete()
@@ -0,0 +1,52 @@
+from functools import partial
+
+from django.db import transaction
+
+from .feed import fan_out, refill
+from .images import build_renditions
+from .models import Recipe
+from .pantry import record_change
+from .similarity import refresh
+from api.cache import bump_recipe_versions
+from core.tasks import background
+from users.models import User
+
+
+@background
+def build_recipe_renditions(name):
+    if build_renditions(name):
+        # До этого в кэше ответов вместо вариантов лежит оригинал.
+        bump_recipe_versions(*Recipe.objects.filter(
+            image=name
+        ).values_list('pk', flat=True))
+
+
+@background
+def fan_out_recipe(recipe_id):
+    recipe = Recipe.objects.select_related('author').filter(
+        pk=recipe_id
+    ).first()
+    if recipe is not None:
+        fan_out(recipe)
+
+
+@background
+def refill_feeds(author_id):
+    author = User.objects.filter(pk=author_id).first()
+    if author is not None:
+        refill(author)
+
+
+@background
+def refresh_similar_recipes(recipe_id):
+    refresh(recipe_id)
+
+
+def refresh_recipe_features(recipe_id):
+    """Обновляет всё, что считается по ингредиентам и тегам рецепта.
+
+    Вызывается при создании рецепта и при изменении его ингредиентов
+    или тегов, но не при правке названия, текста или картинки.
+    """
+    refresh_similar_recipes.delay(recipe_id)
+    transaction.on_commit(partial(record_change, recipe_id))
@@ -0,0 +1,48 @@
+# Generated by Django 3.2.16 on 2026-10-18 03:13
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def recount(model, counter, related_model, field):
+    model.objects.update(**{counter: Coalesce(Subquery(
+        related_model.objects.filter(
+            **{field: OuterRef('pk')}
+        ).order_by().values(field).annotate(
+            total=Count('pk')
+        ).values('total')
+    ), 0)})
+
+
+def fill_counters(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+    recount(
+        User, 'recipes_count', apps.get_model('recipes', 'Recipe'), 'author'
+    )
+    recount(
+        User, 'followers_count',
+        apps.get_model('users', 'Subscription'), 'author'
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0002_initial'),
+        ('users', '0002_user_manager'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='user',
+            name='followers_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество подписчиков'),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='recipes_count',
+            field=models.PositiveIntegerField(default=0, editable=False, verbose_name='Количество рецептов'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
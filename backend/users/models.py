@@ -1,13 +1,35 @@
 from django.contrib.auth.models import AbstractUser
+from django.contrib.auth.models import UserManager as BaseUserManager
 from django.contrib.auth.validators import UnicodeUsernameValidator
 from django.core.validators import RegexValidator
 from django.db import models
+from django.db.models import BooleanField, Exists, OuterRef, Value
 
 from api.validators import validate_username
 from core.enums import Length
+from core.models import ChangedFieldsMixin
 
 
-class User(AbstractUser):
+class UserQuerySet(models.QuerySet):
+
+    def with_is_subscribed(self, user):
+        """Аннотирует пользователей флагом подписки текущего пользователя."""
+        if not user.is_authenticated:
+            return self.annotate(
+                is_subscribed=Value(False, output_field=BooleanField())
+            )
+        return self.annotate(
+            is_subscribed=Exists(Subscription.objects.filter(
+                user=user, author=OuterRef('pk')
+            ))
+        )
+
+
+class UserManager(BaseUserManager.from_queryset(UserQuerySet)):
+    pass
+
+
+class User(ChangedFieldsMixin, AbstractUser):
     """Модель пользователя."""
 
     ADMIN = 'admin'
@@ -52,6 +74,18 @@ class User(AbstractUser):
         choices=USER_ROLES,
         default=USER
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0,
+        editable=False,
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0,
+        editable=False,
+    )
+
+    objects = UserManager()
 
     USERNAME_FIELD = 'email'
     REQUIRED_FIELDS = (
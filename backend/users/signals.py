@@ -0,0 +1,59 @@
+from functools import partial
+
+from django.db import transaction
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+from rest_framework.authtoken.models import Token
+
+from .models import Subscription, User
+from api.authentication import invalidate_tokens
+from api.cache import bump_recipe_versions
+from recipes.counters import change_counter
+
+PUBLIC_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+LOGIN_FIELDS = {'last_login'}
+
+
+@receiver(post_save, sender=Subscription)
+def increment_followers_count(instance, created, **kwargs):
+    if created:
+        change_counter(User, instance.author_id, 'followers_count', 1)
+
+
+@receiver(post_delete, sender=Subscription)
+def decrement_followers_count(instance, **kwargs):
+    change_counter(User, instance.author_id, 'followers_count', -1)
+
+
+@receiver(post_save, sender=User)
+def invalidate_author_recipes(instance, created, update_fields, **kwargs):
+    """Сбрасывает кэш рецептов, если изменились данные автора в них.
+
+    У нового пользователя рецептов ещё нет, а смена пароля или входа
+    не меняет ни одного поля, которое отдаётся вместе с рецептами.
+    """
+    fields = PUBLIC_FIELDS
+    if update_fields:
+        fields = fields & set(update_fields)
+    if created or not instance.changed_fields(fields):
+        return
+    bump_recipe_versions(shared=True)
+
+
+@receiver(post_delete, sender=User)
+def invalidate_deleted_author_recipes(**kwargs):
+    bump_recipe_versions(shared=True)
+
+
+@receiver(post_save, sender=User)
+def invalidate_user_tokens(instance, update_fields, **kwargs):
+    if update_fields and set(update_fields) <= LOGIN_FIELDS:
+        return
+    keys = Token.objects.filter(user=instance).values_list('key', flat=True)
+    if keys:
+        transaction.on_commit(partial(invalidate_tokens, *keys))
+
+
+@receiver(post_delete, sender=Token)
+def invalidate_deleted_token(instance, **kwargs):
+    transaction.on_commit(partial(invalidate_tokens, instance.key))
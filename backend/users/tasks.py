@@ -0,0 +1,22 @@
+from django.db import transaction
+
+from .models import User
+from core.tasks import background
+from recipes.models import Recipe
+
+DELETE_BATCH_SIZE = 100
+
+
+@background(max_attempts=5)
+def delete_user(user_id):
+    """Удаляет пользователя, разбивая каскад по рецептам на пачки."""
+    recipes = Recipe.objects.filter(author_id=user_id).values_list(
+        'pk', flat=True
+    )
+    while True:
+        with transaction.atomic():
+            batch = list(recipes[:DELETE_BATCH_SIZE])
+            if not batch:
+                break
+            Recipe.objects.filter(pk__in=batch).delete()
+    User.objects.filter(pk=user_id).delete()